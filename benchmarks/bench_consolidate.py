@@ -0,0 +1,78 @@
+"""Time and peak allocation of consolidate_all_emails, against the old path
+
+    python -m benchmarks.bench_consolidate -n 2000
+
+The old path kept a transposed one-row DataFrame per email (with its own
+pd.to_datetime) and pd.concat-ed them at the end.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks.synthetic import booking_fields
+from ggrd.gmail import (
+    OUTPOST_DATETIME_FMT,
+    BookingRecord,
+    EmailContent,
+    OutpostEmailClient,
+)
+
+
+def booking_record(i: int) -> BookingRecord:
+    fields = booking_fields(i)
+    return BookingRecord(
+        datetime=fields["when"],
+        booking_ref=fields["booking_ref"],
+        membership_no=str(fields["membership_no"]),
+        membership_name=fields["membership"],
+        class_name=fields["class_name"],
+        location=fields["location"],
+    )
+
+
+def legacy_consolidate(records: list[BookingRecord]) -> pd.DataFrame:
+    dfs = []
+    for record in records:
+        df = pd.DataFrame({k: [getattr(record, k)] for k in record.__slots__})
+        df["datetime"] = pd.to_datetime(df["datetime"], format=OUTPOST_DATETIME_FMT)
+        dfs.append(df)
+    df = pd.concat(dfs)
+    df.sort_values(by="datetime", inplace=True, ascending=True)
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def measure(name: str, func) -> tuple[float, float]:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    df = func()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<12} {len(df):>7} rows {elapsed:8.3f}s {peak / 1e6:8.1f} MB peak"
+        f" {df.memory_usage(deep=True).sum() / 1e6:8.1f} MB frame"
+    )
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=2000, help="number of bookings")
+    args = parser.parse_args()
+
+    records = [booking_record(i) for i in range(args.n)]
+    client = OutpostEmailClient(service=object())
+    client.emails = [EmailContent("", "", "", record=r) for r in records]
+    t_before, m_before = measure("concat", lambda: legacy_consolidate(records))
+    t_after, m_after = measure("single-shot", client.consolidate_all_emails)
+    print(
+        f"speedup      {t_before / t_after:.1f}x, {m_before / m_after:.1f}x less memory"
+    )
+
+
+if __name__ == "__main__":
+    main()
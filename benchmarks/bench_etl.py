@@ -0,0 +1,203 @@
+"""End-to-end ETL benchmark against the offline Gmail/Sheets stand-ins
+
+    python -m benchmarks.bench_etl --messages 10000 --latency 0.02
+
+Stages, each reported with wall time, api requests (http round trips; the
+--json report breaks them down per endpoint), bytes transferred, peak RSS and
+emails/sec:
+
+- email.run: OutpostEmailClient.run over the whole mailbox
+- sheets.update_data: upsert of that result into a half-filled sheet
+- outpost.pull (date): Outpost.pull_updates_from_email with no checkpoint
+- outpost.pull (history): the next pull, through the history checkpoint
+
+The pull stages count the bookings they inserted; a run where that differs
+from --new is flagged and exits with status 1.
+
+With --stream the first stage is a bounded pipeline.Pipeline into a csv file
+instead of email.run, for comparing peak RSS (run each mode in its own
+process; RSS is a high-water mark).
+
+With --noise N every booking arrives with N other emails, which the history
+pull has to sift out (see EmailClient.fetch_matching_batch).
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from googleapiclient.discovery import build
+
+from benchmarks.fake_google import FakeGmail, FakeSpreadsheet
+from ggrd.cache import MessageCache
+from ggrd.gmail import MAX_BATCH_SIZE, OutpostEmailClient
+from ggrd.outpost import Outpost
+from ggrd.pipeline import CsvSink, Pipeline
+from ggrd.sheets import GoogleSheetClient
+
+
+@dataclasses.dataclass
+class StageReport:
+    stage: str
+    emails: int
+    wall_time: float
+    gmail_calls: int
+    sheets_calls: int
+    bytes_transferred: int
+    peak_rss_mb: float
+    calls: dict = dataclasses.field(default_factory=dict)
+
+    @property
+    def emails_per_sec(self) -> float:
+        return self.emails / self.wall_time if self.wall_time else 0.0
+
+    def row(self) -> str:
+        return (
+            f"{self.stage:<24}{self.emails:>8}{self.wall_time:>10.2f}"
+            f"{self.emails_per_sec:>12.1f}{self.gmail_calls:>8}{self.sheets_calls:>8}"
+            f"{self.bytes_transferred / 1e6:>10.1f}{self.peak_rss_mb:>10.1f}"
+        )
+
+
+HEADER = (
+    f"{'stage':<24}{'emails':>8}{'wall(s)':>10}{'emails/s':>12}"
+    f"{'gmail':>8}{'sheets':>8}{'MB xfer':>10}{'RSS(MB)':>10}"
+)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Bench:
+    def __init__(self, gmail: FakeGmail, ss: FakeSpreadsheet):
+        self.gmail = gmail
+        self.ss = ss
+        self.reports: list[StageReport] = []
+
+    def measure(self, stage: str, func, emails: Optional[int] = None):
+        self.gmail.counters.reset()
+        self.ss.counters.reset()
+        t0 = time.perf_counter()
+        result = func()
+        wall_time = time.perf_counter() - t0
+        if emails is None:
+            # a count (e.g. bookings inserted) or the records themselves
+            emails = result if isinstance(result, int) else len(result)
+        gmail_stats = self.gmail.counters.snapshot()
+        sheets_stats = self.ss.counters.snapshot()
+        report = StageReport(
+            stage=stage,
+            emails=emails,
+            wall_time=wall_time,
+            gmail_calls=gmail_stats["requests"],
+            sheets_calls=sheets_stats["requests"],
+            bytes_transferred=gmail_stats["bytes_transferred"]
+            + sheets_stats["bytes_transferred"],
+            peak_rss_mb=peak_rss_mb(),
+            calls={"gmail": gmail_stats["calls"], "sheets": sheets_stats["calls"]},
+        )
+        self.reports.append(report)
+        print(report.row(), flush=True)
+        return result
+
+
+def email_client(gmail: FakeGmail, args, cache: Optional[MessageCache] = None):
+    service = build("gmail", "v1", http=gmail.http(), static_discovery=True)
+    return OutpostEmailClient(
+        service=service,
+        batch_size=args.batch_size,
+        cache=cache,
+        parse_workers=args.parse_workers,
+        session=gmail.session(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--new", type=int, default=50, help="mail per pull")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument(
+        "--max-in-flight", type=int, default=0, help="fetch with AsyncEmailClient"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of 429s on messages.get"
+    )
+    parser.add_argument("--stream", action="store_true", help="see above")
+    parser.add_argument("--noise", type=int, default=0, help="other mail per booking")
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory(prefix="ggrd-bench-")
+    os.environ["GGRD_STATE_DIR"] = tmpdir.name
+
+    gmail = FakeGmail(
+        n_messages=args.messages - args.new,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        noise=args.noise,
+    )
+    ss = FakeSpreadsheet(latency=args.latency)
+    bench = Bench(gmail, ss)
+    print(HEADER)
+
+    email = email_client(gmail, args)
+    if args.stream:
+        columns = list(email.kws.values())
+        csv_filepath = Path(tmpdir.name) / "bookings.csv"
+        pipeline = Pipeline(email, CsvSink(csv_filepath, columns))
+        bench.measure(
+            "pipeline.run (csv)",
+            lambda: pipeline.run(email.iter_booking_pages()),
+            emails=gmail.n_messages,
+        )
+        df = pd.read_csv(csv_filepath, dtype=str, parse_dates=["datetime"])
+    else:
+        df = bench.measure(
+            "email.run", lambda: email.run(max_in_flight=args.max_in_flight)
+        )
+    email.close()
+
+    gsc = GoogleSheetClient(spreadsheet=ss)
+    dfs = gsc.parse_data_for_gsheet(df)
+    half = len(dfs) // 2
+    ss.seed("data", [list(dfs.columns)] + dfs.values.tolist()[:half])
+    bench.measure("sheets.update_data", lambda: gsc.update_data(df), emails=len(df))
+
+    # a sheet holding everything so far; new mail arrives before each pull
+    ss.seed("data", [list(dfs.columns)] + dfs.values.tolist())
+    cache = MessageCache(max_entries=0)
+    op = Outpost(
+        email=email_client(gmail, args, cache), gsc=GoogleSheetClient(spreadsheet=ss)
+    )
+    lost = False
+    for stage in ["outpost.pull (date)", "outpost.pull (history)"]:
+        gmail.add_messages(args.new)
+        inserted = bench.measure(stage, op.pull_updates_from_email)
+        if inserted != args.new:
+            print(f"!! {stage}: inserted {inserted} of {args.new} new bookings")
+            lost = True
+    op.email.close()
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump([dataclasses.asdict(r) for r in bench.reports], fp, indent=2)
+    tmpdir.cleanup()
+    if lost:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Cold-start import cost of the ggrd entry points, from python -X importtime
+
+python -m benchmarks.bench_import_time --repeat 5
+
+Each target is imported in a fresh interpreter; the report is the best of
+--repeat runs of its cumulative import time, plus which heavy dependencies
+it pulled in. `cli` and `ggrd.outpost` are what a cron `pull --check-first`
+loads before it knows whether there is anything to do.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+TARGETS = [
+    "cli",
+    "ggrd.outpost",
+    "ggrd.daemon",
+    "ggrd.auth",
+    "ggrd.gmail",
+    "ggrd.sheets",
+]
+HEAVY = ["pandas", "gspread", "googleapiclient", "google_auth_oauthlib", "pyarrow"]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds per top-level package"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    # "import time: self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        times[name] = max(times.get(name, 0), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("targets", nargs="*", default=TARGETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{'module':<20}{'import(ms)':>12}  heavy dependencies")
+    results = []
+    for module in args.targets:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        heavy = [name for name in HEAVY if name in best]
+        results.append(
+            {"module": module, "import_ms": best[module] / 1000, "heavy": heavy}
+        )
+        print(f"{module:<20}{best[module] / 1000:>12.1f}  {', '.join(heavy) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
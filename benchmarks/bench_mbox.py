@@ -0,0 +1,75 @@
+"""Backfill throughput of ggrd.mbox.MboxSource over a synthetic Takeout mbox
+
+    python -m benchmarks.bench_mbox -n 20000 --noise 10 --workers 1 4
+
+Writes an mbox with `n` bookings, each followed by `noise` newsletters,
+then times MboxSource.frames() for each worker count.
+"""
+
+import argparse
+import tempfile
+import time
+from datetime import timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from pathlib import Path
+
+from benchmarks.synthetic import NEWSLETTER, SENDER, booking_fields, booking_html
+from ggrd.mbox import MboxSource
+
+
+def mbox_message(message_id: int, sender: str, subject: str, html: str, when) -> bytes:
+    message = EmailMessage()
+    message["From"] = sender
+    message["Subject"] = subject
+    message["Date"] = format_datetime(when)
+    message.set_content(html, subtype="html")
+    envelope = f"From {message_id}@xxx {when.strftime('%a %b %d %H:%M:%S +0000 %Y')}"
+    return envelope.encode() + b"\n" + message.as_bytes() + b"\n"
+
+
+def write_mbox(filepath: Path, n: int, noise: int) -> None:
+    with open(filepath, "wb") as fp:
+        for i in range(n):
+            fields = booking_fields(i)
+            when = fields["internal_date"]
+            subject = f"Booking confirmed: {fields['class_name']}"
+            fp.write(
+                mbox_message(i * (noise + 1), SENDER, subject, booking_html(i), when)
+            )
+            for j in range(noise):
+                fp.write(
+                    mbox_message(
+                        i * (noise + 1) + j + 1,
+                        "Climbing Weekly <news@example.invalid>",
+                        "This week at the wall",
+                        NEWSLETTER,
+                        when + timedelta(minutes=j),
+                    )
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=20_000, help="bookings")
+    parser.add_argument("--noise", type=int, default=10, help="other mail per booking")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="ggrd-bench-") as tmpdir:
+        filepath = Path(tmpdir) / "takeout.mbox"
+        write_mbox(filepath, args.n, args.noise)
+        size_mb = filepath.stat().st_size / 1e6
+        print(f"{args.n * (args.noise + 1)} messages, {size_mb:.0f} MB")
+        for workers in args.workers:
+            t0 = time.perf_counter()
+            df = MboxSource(filepath, workers=workers).frames()["outpost"]
+            wall_time = time.perf_counter() - t0
+            print(
+                f"workers={workers:<3}{wall_time:>8.2f}s {size_mb / wall_time:>8.0f} MB/s"
+                f" {len(df) / wall_time:>10.0f} bookings/s  {len(df)} bookings"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Emails/sec for OutpostEmailClient.parse_html, against the old pd.read_html path
+
+python -m benchmarks.bench_parse_html -n 2000
+"""
+
+import argparse
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import booking_html
+from ggrd.gmail import OutpostEmailClient
+
+KWS = {
+    "Date & time": "datetime",
+    "Booking ref": "booking_ref",
+    "Membership No": "membership_no",
+    "Membership": "membership_name",
+    "Class": "class_name",
+    "Location": "location",
+}
+
+
+def legacy_parse_html(html_str: str) -> pd.DataFrame:
+    # parse_html as it was before the dedicated parser, kept for comparison
+    dfs = [None]
+    with tempfile.NamedTemporaryFile(delete=True) as fp:
+        with open(fp.name, "w") as fwriter:
+            fwriter.write(html_str)
+        dfs = pd.read_html(fp)  # type: ignore
+    for df in dfs:
+        dff = df[df[0].isin(KWS)]
+        if len(dff) < len(KWS):
+            continue
+        df = dff.copy()
+        df[0] = df[0].replace(KWS)
+        df.set_index(0, inplace=True)
+        df = df.T
+        df["datetime"] = pd.to_datetime(
+            df["datetime"], format="%d %b %Y @ %H:%M %p", errors="raise"
+        )
+        return df
+    return pd.DataFrame()
+
+
+def bench(name: str, func, htmls: list[str]) -> float:
+    t0 = time.perf_counter()
+    for html in htmls:
+        func(html)
+    elapsed = time.perf_counter() - t0
+    rate = len(htmls) / elapsed
+    print(f"{name:<10} {len(htmls):>6} emails {elapsed:8.3f}s {rate:10.1f} emails/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=1000, help="number of emails")
+    args = parser.parse_args()
+
+    htmls = [booking_html(i) for i in range(args.n)]
+    # parse_html never touches the gmail service
+    client = OutpostEmailClient(service=object())
+    before = bench("read_html", legacy_parse_html, htmls)
+    after = bench("parse_html", client.parse_html, htmls)
+    print(f"speedup    {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Full sheet rebuild: GoogleSheetClient.reset_and_write_data against the
+old clear-then-update path, on the offline Sheets stand-in
+
+    python -m benchmarks.bench_sheets_write -n 100000 --latency 0.2
+
+The stand-in charges --latency per request plus upload time at
+--bandwidth, and rejects requests over --max-request-mb like the real api.
+The old path sends the whole sheet in one request, so large rebuilds fail,
+after the worksheet has already been cleared.
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from benchmarks.bench_consolidate import booking_record
+from benchmarks.fake_google import FakeSpreadsheet
+from ggrd.gmail import OutpostEmailClient
+from ggrd.sheets import GoogleSheetClient
+
+
+def legacy_reset_and_write_data(gsc: GoogleSheetClient, df: pd.DataFrame) -> None:
+    # reset_and_write_data as it was before the staged bulk writer
+    worksheet = gsc.get_worksheet("data")
+    worksheet.clear()
+    df = gsc.parse_data_for_gsheet(df)
+    worksheet.update(values=[list(df.columns)], range_name="A1")
+    worksheet.update(values=df.values.tolist(), range_name="A2")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=100_000, help="rows")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds")
+    parser.add_argument("--bandwidth", type=float, default=2.0, help="MB/s")
+    parser.add_argument("--max-request-mb", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    email = OutpostEmailClient(service=object())
+    df = email.to_frame([booking_record(i) for i in range(args.n)])
+
+    for name in ["legacy", "staged"]:
+        ss = FakeSpreadsheet(
+            latency=args.latency,
+            bandwidth=args.bandwidth * 1e6,
+            max_request_bytes=int(args.max_request_mb * 1e6),
+        )
+        # a sheet sized for the old data, as after earlier rebuilds
+        ss.seed("data", [list(df.columns)])
+        ss.worksheets["data"].resize(rows=args.n + 1)
+        gsc = GoogleSheetClient(spreadsheet=ss, use_mirror=False)
+        t0 = time.perf_counter()
+        try:
+            if name == "legacy":
+                legacy_reset_and_write_data(gsc, df)
+            else:
+                gsc.reset_and_write_data(df, max_workers=args.workers)
+            status = "ok"
+        except ValueError as e:
+            status = f"failed: {e}"
+        wall_time = time.perf_counter() - t0
+        stats = ss.counters.snapshot()
+        rows = len(ss.worksheets["data"].values) - 1
+        print(
+            f"{name:<8}{wall_time:>8.2f}s {stats['requests']:>4} requests"
+            f" {stats['bytes_transferred'] / 1e6:>7.1f} MB"
+            f" {rows:>8} rows in sheet  {status}"
+        )
+
+
+if __name__ == "__main__":
+    main()
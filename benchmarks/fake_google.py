@@ -0,0 +1,483 @@
+"""In-process stand-ins for the Gmail api and a gspread spreadsheet.
+
+FakeGmailHttp speaks the httplib2 `request()` interface, so a real
+googleapiclient service can be built on it:
+
+    gmail = FakeGmail(n_messages=1000, latency=0.05)
+    service = build("gmail", "v1", http=gmail.http(), static_discovery=True)
+
+FakeGmailSession does the same for requests-style callers (AsyncEmailClient).
+
+Every http round trip sleeps `latency` seconds and is counted per endpoint,
+together with the bytes it carried. Messages come from benchmarks.synthetic
+and are generated on demand, so 100k messages cost no memory up front.
+Partial responses (`fields`, format=metadata) are honoured, so their savings
+show up in the byte counts.
+"""
+
+import bisect
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import gspread
+import httplib2
+import requests
+
+from benchmarks.synthetic import booking_fields, booking_message, newsletter_message
+
+
+def parse_fields(mask: str) -> dict:
+    """A partial-response mask like 'id,payload(headers,body/data)' as a tree"""
+    tokens = re.findall(r"[^,()]+|[(),]", mask)
+    pos = 0
+
+    def parse() -> dict:
+        nonlocal pos
+        tree: dict = {}
+        while pos < len(tokens) and tokens[pos] != ")":
+            token = tokens[pos]
+            pos += 1
+            if token == ",":
+                continue
+            node = tree
+            for name in token.strip().split("/"):
+                node = node.setdefault(name, {})
+            if pos < len(tokens) and tokens[pos] == "(":
+                pos += 1
+                node.update(parse())
+                pos += 1  # the closing bracket
+        return tree
+
+    return parse()
+
+
+def apply_fields(obj, tree: dict):
+    """Keep only the fields in `tree`; an empty tree keeps everything"""
+    if not tree:
+        return obj
+    if isinstance(obj, list):
+        return [apply_fields(item, tree) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    return {k: apply_fields(obj[k], sub) for k, sub in tree.items() if k in obj}
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: collections.Counter = collections.Counter()
+        self.bytes_transferred = 0
+
+    def add(self, endpoint: str, n_bytes: int = 0) -> None:
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.bytes_transferred += n_bytes
+
+    def snapshot(self) -> dict:
+        """Per-endpoint calls; `requests` counts http round trips only"""
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "requests": sum(
+                    n for k, n in self.calls.items() if not k.startswith("batch:")
+                ),
+                "bytes_transferred": self.bytes_transferred,
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.calls.clear()
+            self.bytes_transferred = 0
+
+
+class FakeGmail:
+    """Mailbox of `n_messages` synthetic bookings; message i has historyId i+1.
+
+    Each booking arrives along with `noise` other emails. They are invisible to
+    the booking query but do show up in history.list, as in a real inbox.
+    """
+
+    def __init__(
+        self,
+        n_messages: int = 1000,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        noise: int = 0,
+    ):
+        self.n_messages = n_messages
+        self.latency = latency
+        self.noise = noise
+        # share of messages.get answered with 429 rateLimitExceeded
+        self.error_rate = error_rate
+        self.counters = Counters()
+
+    def http(self) -> "FakeGmailHttp":
+        return FakeGmailHttp(self)
+
+    def session(self) -> "FakeGmailSession":
+        return FakeGmailSession(self)
+
+    def add_messages(self, n: int) -> None:
+        self.n_messages += n
+
+    def message_id(self, i: int) -> str:
+        return f"{i:016x}"
+
+    def noise_ids(self, i: int) -> list[str]:
+        return [f"{self.message_id(i)}-{j}" for j in range(self.noise)]
+
+    def get_message(self, message_id: str, params: dict) -> tuple[int, dict]:
+        i = int(message_id.split("-")[0], 16)
+        if self.error_rate and random.random() < self.error_rate:
+            error = {"code": 429, "errors": [{"reason": "rateLimitExceeded"}]}
+            return 429, {"error": error}
+        if i >= self.n_messages:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        if "-" in message_id:
+            msg = newsletter_message(message_id, booking_fields(i)["internal_date"])
+        else:
+            msg = booking_message(i)
+        msg["historyId"] = str(i + 1)
+        msg["labelIds"] = ["INBOX", "CATEGORY_UPDATES"]
+        msg["snippet"] = msg["payload"]["headers"][1]["value"]
+        msg["sizeEstimate"] = len(json.dumps(msg))
+        if params.get("format") == "metadata":
+            wanted = params.get("metadataHeaders") or []
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            msg["payload"] = {
+                "mimeType": msg["payload"]["mimeType"],
+                "headers": [
+                    h
+                    for h in msg["payload"]["headers"]
+                    if not wanted or h["name"] in wanted
+                ],
+            }
+        if "fields" in params:
+            msg = apply_fields(msg, parse_fields(params["fields"]))
+        return 200, msg
+
+    def list_messages(self, params: dict) -> dict:
+        page_size = int(params.get("maxResults", 100))
+        start = int(params.get("pageToken", 0))
+        first = 0
+        match = re.search(r"after:(\S+)", params.get("q", ""))
+        if match:
+            after = datetime.strptime(match.group(1).replace("-", "/"), "%Y/%m/%d")
+            # internal dates grow with the index, so the cut-off is a bisection
+            first = bisect.bisect_left(
+                range(self.n_messages),
+                after,
+                key=lambda i: booking_fields(i)["internal_date"],
+            )
+        indices = range(self.n_messages - 1, first - 1, -1)  # newest first
+        page = indices[start : start + page_size]
+        response = {"messages": [{"id": self.message_id(i)} for i in page]}
+        if start + page_size < len(indices):
+            response["nextPageToken"] = str(start + page_size)
+        response["resultSizeEstimate"] = len(indices)
+        return response
+
+    def list_history(self, params: dict) -> dict:
+        start = int(params["startHistoryId"])
+        if start < 1:
+            return {}
+        page_size = int(params.get("maxResults", 100))
+        first = max(start, int(params.get("pageToken", start)))
+        last = min(self.n_messages, first + page_size)
+        response = {
+            "history": [
+                {
+                    "id": str(i + 1),
+                    "messagesAdded": [
+                        {"message": {"id": message_id}}
+                        for message_id in [self.message_id(i), *self.noise_ids(i)]
+                    ],
+                }
+                for i in range(first, last)
+            ],
+            "historyId": str(self.n_messages),
+        }
+        if last < self.n_messages:
+            response["nextPageToken"] = str(last)
+        return response
+
+    def handle(self, method: str, uri: str) -> tuple[int, dict, str]:
+        url = urlparse(uri)
+        params = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.split("/gmail/v1/users/me/", 1)[-1]
+        if path == "profile":
+            return 200, {"historyId": str(self.n_messages)}, "profile"
+        if path == "history":
+            return 200, self.list_history(params), "history.list"
+        if path == "messages":
+            return 200, self.list_messages(params), "messages.list"
+        if path.startswith("messages/"):
+            parts = path.split("/")
+            if len(parts) == 2:
+                status, body = self.get_message(parts[1], params)
+                return status, body, "messages.get"
+        return 404, {"error": {"code": 404, "message": f"unknown {path}"}}, "unknown"
+
+
+class FakeGmailHttp:
+    """httplib2.Http look-alike routing requests to a FakeGmail"""
+
+    # stateless, so EmailClient may list pages from a second thread
+    thread_safe = True
+
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        time.sleep(self.gmail.latency)
+        if urlparse(uri).path.startswith("/batch"):
+            return self.batch(body)
+        status, response, endpoint = self.gmail.handle(method, uri)
+        content = json.dumps(response).encode()
+        self.gmail.counters.add(endpoint, len(content))
+        return httplib2.Response({"status": str(status)}), content
+
+    def batch(self, body):
+        if isinstance(body, bytes):
+            body = body.decode()
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        requests = re.findall(
+            r"Content-ID: <(.+?)>\r?\n.*?\n(GET|POST) (\S+) HTTP", body, re.S
+        )
+        for content_id, method, path in requests:
+            status, response, endpoint = self.gmail.handle(method, path)
+            # per-item calls are counted too: they spend the same quota units
+            self.gmail.counters.add(f"batch:{endpoint}")
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(response)}\r\n"
+            )
+        content = ("".join(parts) + f"--{boundary}--").encode()
+        self.gmail.counters.add("batch", len(content))
+        headers = {
+            "status": "200",
+            "content-type": f"multipart/mixed; boundary={boundary}",
+        }
+        return httplib2.Response(headers), content
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes, headers: dict):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                f"{self.status_code}: {self.content[:200]!r}", response=self
+            )
+
+
+class FakeGmailSession:
+    """requests.Session look-alike routing requests to a FakeGmail"""
+
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def request(self, method, url, params=None, **kwargs):
+        time.sleep(self.gmail.latency)
+        if params:
+            url = f"{url}?{urlencode(params, doseq=True)}"
+        status, response, endpoint = self.gmail.handle(method, url)
+        content = json.dumps(response).encode()
+        self.gmail.counters.add(endpoint, len(content))
+        headers = {"Retry-After": "0"} if status == 429 else {}
+        return FakeResponse(status, content, headers)
+
+
+def a1_to_row(a1: str) -> int:
+    """1-based row of the top-left cell of a range like 'A2', 'A2:F' or '5:1000'"""
+    match = re.match(r"[A-Z]*(\d+)", a1.split("!")[-1])
+    return int(match.group(1)) if match else 1
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", title: str, rows: int = 1000):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.index = len(spreadsheet.worksheets)
+        self.values: list[list] = []
+        self._row_count = rows
+        self.id = abs(hash(title)) % 10**9
+
+    def call(self, endpoint: str, payload=None) -> None:
+        self.spreadsheet.call(endpoint, payload)
+
+    @property
+    def row_count(self) -> int:
+        return max(self._row_count, len(self.values))
+
+    def get(self, range_name: str):
+        start = a1_to_row(range_name)
+        values = [[str(v) for v in row] for row in self.values[start - 1 :]]
+        self.call("values.get", values)
+        return values
+
+    def row_values(self, row: int):
+        return self.get(f"{row}:{row}")[0] if row <= len(self.values) else []
+
+    def col_values(self, col: int):
+        values = [str(row[col - 1]) if len(row) >= col else "" for row in self.values]
+        while values and not values[-1]:
+            values.pop()
+        self.call("values.get", values)
+        return values
+
+    def get_all_values(self):
+        values = [[str(v) for v in row] for row in self.values]
+        self.call("values.get", values)
+        return values
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+
+        def numericise(v: str):
+            return int(v) if v.isdigit() else v
+
+        return [dict(zip(header, map(numericise, row))) for row in values[1:]]
+
+    def update(self, values=None, range_name: str = "A1", **kwargs):
+        self.call("values.update", values)
+        start = a1_to_row(range_name) - 1
+        if start + len(values) > self.row_count:
+            raise ValueError("exceeds grid limits")
+        # bulk writes update disjoint ranges from several threads
+        with self.spreadsheet.lock:
+            while len(self.values) < start + len(values):
+                self.values.append([])
+            for i, row in enumerate(values):
+                self.values[start + i] = list(row)
+            self.spreadsheet.touch()
+
+    def append_rows(self, values, **kwargs):
+        self.call("values.append", values)
+        self.values.extend(list(row) for row in values)
+        self.spreadsheet.touch()
+
+    def sort(self, *specs, range: str = None):
+        """sortRange over whole rows of `range` (e.g. 'A2:H100'), as strings"""
+        self.call("batchUpdate")
+        start, end = (a1_to_row(a1) for a1 in range.split(":"))
+        with self.spreadsheet.lock:
+            rows = self.values[start - 1 : end]
+            for col, order in reversed(specs):
+                rows.sort(key=lambda row: str(row[col - 1]), reverse=order == "des")
+            self.values[start - 1 : end] = rows
+            self.spreadsheet.touch()
+
+    def clear(self):
+        self.call("values.clear")
+        self.values = []
+        self.spreadsheet.touch()
+
+    def resize(self, rows=None, cols=None):
+        self.call("batchUpdate")
+        if rows is not None:
+            self._row_count = rows
+        self.spreadsheet.touch()
+
+
+class FakeSpreadsheet:
+    """Just enough of gspread.Spreadsheet for GoogleSheetClient"""
+
+    def __init__(
+        self,
+        title: str = "ggrd-bench",
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        max_request_bytes: int = 0,
+    ):
+        """`bandwidth` (bytes/sec) adds upload time per request; requests
+        over `max_request_bytes` are rejected, as the real api does"""
+        self.id = f"fake-{uuid.uuid4().hex[:8]}"
+        self.title = title
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_request_bytes = max_request_bytes
+        self.counters = Counters()
+        self.worksheets: dict[str, FakeWorksheet] = {}
+        self.modified = 0
+        self.lock = threading.Lock()
+
+    def call(self, endpoint: str, payload=None) -> None:
+        n_bytes = len(json.dumps(payload)) if payload is not None else 0
+        if self.max_request_bytes and n_bytes > self.max_request_bytes:
+            raise ValueError(f"{endpoint} payload too large, {n_bytes=}")
+        upload_time = n_bytes / self.bandwidth if self.bandwidth else 0.0
+        time.sleep(self.latency + upload_time)
+        self.counters.add(endpoint, n_bytes)
+
+    def touch(self) -> None:
+        self.modified += 1
+
+    def seed(self, sheet_name: str, values: list[list]) -> None:
+        """Fill a worksheet directly, without counting api calls"""
+        worksheet = self.worksheets.setdefault(
+            sheet_name, FakeWorksheet(self, sheet_name)
+        )
+        worksheet.values = [list(row) for row in values]
+        self.touch()
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.call("metadata")
+        if title not in self.worksheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.worksheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs):
+        self.call("batchUpdate")
+        self.worksheets[title] = FakeWorksheet(self, title, rows=rows)
+        self.touch()
+        return self.worksheets[title]
+
+    def del_worksheet(self, worksheet: FakeWorksheet) -> None:
+        self.call("batchUpdate")
+        self.worksheets.pop(worksheet.title, None)
+        self.touch()
+
+    def batch_update(self, body: dict) -> dict:
+        """deleteSheet and updateSheetProperties (title), all or nothing"""
+        self.call("batchUpdate", body)
+        by_id = {ws.id: ws for ws in self.worksheets.values()}
+        worksheets = dict(self.worksheets)
+        for request in body["requests"]:
+            if "deleteSheet" in request:
+                worksheets.pop(by_id[request["deleteSheet"]["sheetId"]].title)
+            elif "updateSheetProperties" in request:
+                properties = request["updateSheetProperties"]["properties"]
+                worksheet = by_id[properties["sheetId"]]
+                worksheets.pop(worksheet.title)
+                worksheet.title = properties.get("title", worksheet.title)
+                worksheets[worksheet.title] = worksheet
+            else:
+                raise NotImplementedError(request)
+        self.worksheets = worksheets
+        self.touch()
+        return {"replies": [{} for _ in body["requests"]]}
+
+    def get_lastUpdateTime(self) -> str:
+        self.call("drive.files.get")
+        return str(self.modified)
@@ -0,0 +1,127 @@
+"""Synthetic Outpost booking confirmation emails for offline benchmarks"""
+
+import base64
+import random
+from datetime import datetime, timedelta
+
+SENDER = "Outpost Climbing <no-reply@outpostclimbing.rezeve.com>"
+CLASSES = ["Bouldering 101", "Lead Climbing", "Open Session", "Yoga for Climbers"]
+LOCATIONS = ["Outpost Paya Lebar", "Outpost Bukit Timah"]
+MEMBERSHIPS = ["Monthly Unlimited", "10-Entry Pass", "Off-Peak"]
+
+STYLE = "\n".join(
+    f".c{i} {{ font-family: Helvetica, Arial; padding: {i % 12}px; color: #3{i % 10}3; }}"
+    for i in range(120)
+)
+
+TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Booking confirmed</title>
+<style type="text/css">{style}</style></head>
+<body style="margin:0;padding:0">
+<table width="100%" cellpadding="0" cellspacing="0" class="c1"><tr><td align="center">
+  <table width="600" class="c2"><tr><td>
+    <img src="https://example.invalid/logo.png" alt="Outpost" width="180">
+  </td></tr>
+  <tr><td class="c3"><h1>Your booking is confirmed</h1>
+    <p>Hi {first_name}, thanks for booking with us. Please arrive 10 minutes early
+    and bring your membership card. See you on the wall!</p>
+  </td></tr>
+  <tr><td>
+    <table class="c4" cellpadding="4">
+      <tr><td><b>Name</b></td><td>{first_name} Tan</td></tr>
+      <tr><td>Date &amp; time</td><td>{when}</td></tr>
+      <tr><td>Booking ref</td><td>{booking_ref}</td></tr>
+      <tr><td>Membership No</td><td>{membership_no}</td></tr>
+      <tr><td>Membership</td><td>{membership}</td></tr>
+      <tr><td>Class</td><td>{class_name}</td></tr>
+      <tr><td>Location</td><td>{location}</td></tr>
+      <tr><td>Price</td><td>S$0.00</td></tr>
+    </table>
+  </td></tr>
+  <tr><td class="c5">{footer}</td></tr>
+  </table>
+</td></tr></table>
+</body></html>"""
+
+FOOTER = " ".join(
+    ["You are receiving this email because you made a booking at Outpost."] * 20
+)
+
+
+def booking_fields(i: int, start: datetime = datetime(2023, 1, 1)) -> dict:
+    rng = random.Random(i)
+    when = start + timedelta(hours=3 * i, minutes=rng.choice([0, 15, 30, 45]))
+    return {
+        "when": when.strftime("%d %b %Y @ %I:%M %p"),
+        "booking_ref": f"OP{100000 + i}",
+        "membership_no": 20000 + rng.randrange(500),
+        "membership": rng.choice(MEMBERSHIPS),
+        "class_name": rng.choice(CLASSES),
+        "location": rng.choice(LOCATIONS),
+        "internal_date": when - timedelta(days=2),
+    }
+
+
+def booking_html(i: int) -> str:
+    fields = booking_fields(i)
+    return TEMPLATE.format(style=STYLE, first_name="Jake", footer=FOOTER, **fields)
+
+
+def booking_message(i: int) -> dict:
+    """A messages.get (format=full) response for booking `i`"""
+    fields = booking_fields(i)
+    html = booking_html(i)
+    return {
+        "id": f"{i:016x}",
+        "threadId": f"{i:016x}",
+        "internalDate": str(int(fields["internal_date"].timestamp() * 1000)),
+        "payload": {
+            "mimeType": "text/html",
+            "headers": [
+                {"name": "From", "value": SENDER},
+                {
+                    "name": "Subject",
+                    "value": f"Booking confirmed: {fields['class_name']}",
+                },
+                {"name": "Date", "value": fields["internal_date"].isoformat()},
+            ],
+            "body": {
+                "size": len(html),
+                "data": base64.urlsafe_b64encode(html.encode()).decode(),
+            },
+        },
+    }
+
+
+NEWSLETTER = TEMPLATE.format(
+    style=STYLE,
+    first_name="Jake",
+    when="",
+    booking_ref="",
+    membership_no="",
+    membership="",
+    class_name="",
+    location="",
+    footer=FOOTER * 3,
+).replace("Your booking is confirmed", "This week at the wall")
+
+
+def newsletter_message(message_id: str, internal_date: datetime) -> dict:
+    """Some other mail in the inbox: a different sender and a bigger body"""
+    return {
+        "id": message_id,
+        "threadId": message_id,
+        "internalDate": str(int(internal_date.timestamp() * 1000)),
+        "payload": {
+            "mimeType": "text/html",
+            "headers": [
+                {"name": "From", "value": "Climbing Weekly <news@example.invalid>"},
+                {"name": "Subject", "value": "This week at the wall"},
+                {"name": "Date", "value": internal_date.isoformat()},
+            ],
+            "body": {
+                "size": len(NEWSLETTER),
+                "data": base64.urlsafe_b64encode(NEWSLETTER.encode()).decode(),
+            },
+        },
+    }
@@ -1,5 +1,9 @@
-from ggrd.outpost import Outpost
-from ggrd.utils import CustomLogger
+import argparse
+import cProfile
+from pathlib import Path
+
+from ggrd.metrics import METRICS
+from ggrd.utils import CustomLogger, get_state_dirpath
 
 APP_NAME = "ggrd"
 clg = CustomLogger(APP_NAME)
@@ -7,10 +11,79 @@ lg = clg.getLogger()
 
 
 def main():
+    parser = argparse.ArgumentParser(prog=APP_NAME)
+    parser.add_argument(
+        "--report-dir",
+        type=Path,
+        help="where to write ggrd-run.json and ggrd.prom (default: state/reports)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="run under cProfile; stats go to ggrd-run.prof in the report dir",
+    )
+    commands = parser.add_subparsers(dest="command")
+    pull = commands.add_parser("pull", help="append new bookings to the sheet")
+    pull.add_argument(
+        "--check-first",
+        action="store_true",
+        help="exit early if no mail has arrived since the last pull",
+    )
+    commands.add_parser("reset", help="rebuild the sheet from the mailbox")
+    backfill = commands.add_parser(
+        "backfill", help="load bookings from a local mbox (google takeout) export"
+    )
+    backfill.add_argument("mbox", type=Path)
+    backfill.add_argument(
+        "--reset", action="store_true", help="replace the sheet instead of adding to it"
+    )
+    backfill.add_argument("--workers", type=int, default=0, help="default: all cores")
+    daemon = commands.add_parser("daemon", help="keep pulling, for every account")
+    daemon.add_argument(
+        "--accounts",
+        type=Path,
+        help="json list of {name, secrets_dirpath, spreadsheet_name}",
+    )
+    daemon.add_argument("--max-workers", type=int, default=4)
+    args = parser.parse_args()
+    report_dir = args.report_dir or get_state_dirpath() / "reports"
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        run(args, report_dir)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            report_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(report_dir / f"{APP_NAME}-run.prof")
+        json_filepath, _ = METRICS.write_reports(report_dir)
+        lg.info(f"run report written to {json_filepath}")
+
+
+def run(args: argparse.Namespace, report_dir: Path) -> None:
+    # imported here so `--help` and no-op runs skip the google clients
+    if args.command == "daemon":
+        from ggrd.daemon import Daemon, Job, load_accounts
+
+        accounts = load_accounts(args.accounts) if args.accounts else []
+        jobs = [Job(account) for account in accounts] or [Job.default()]
+        daemon = Daemon(jobs, max_workers=args.max_workers, report_dir=report_dir)
+        daemon.run_forever()
+        return
+
+    from ggrd.outpost import Outpost
+
     op = Outpost()
-    # op.reset_data()
-    op.pull_updates_from_email()
-    # ec.logout()
+    if args.command == "reset":
+        op.reset_data()
+    elif args.command == "backfill":
+        op.backfill_from_mbox(args.mbox, reset=args.reset, workers=args.workers)
+    elif getattr(args, "check_first", False) and not op.has_updates():
+        lg.info("mailbox unchanged since last pull; nothing to do")
+    else:
+        op.pull_updates_from_email()
 
 
 if __name__ == "__main__":
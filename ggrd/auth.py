@@ -1,25 +1,188 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+from urllib.parse import urlsplit
 
-import gspread
 from google.auth import exceptions as g_exceptions
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from requests.adapters import HTTPAdapter
+
+# googleapiclient, gspread, httplib2 and the oauth flow are imported where
+# they are used: a cron run with nothing to do never needs them
+if TYPE_CHECKING:
+    import google_auth_httplib2
+    import gspread
 
 try:
-    from utils import CustomLogger
+    from metrics import METRICS
+    from utils import CustomLogger, get_state_dirpath
 except ImportError:
-    from ggrd.utils import CustomLogger
+    from ggrd.metrics import METRICS
+    from ggrd.utils import CustomLogger, get_state_dirpath
 
 APP_NAME = "ggrd"
+# refresh this long before the access token expires, rather than mid-run
+REFRESH_MARGIN = timedelta(minutes=5)
+# keep-alive connections per host for the requests-based transports
+POOL_SIZE = 10
+GMAIL_HISTORY_URL = "https://gmail.googleapis.com/gmail/v1/users/me/history"
 
 
-class GoogleAuthManager:
+def record_response(api: str, status: int, n_bytes: int, seconds: float) -> None:
+    """Per-api request, byte and latency metrics for every http round trip"""
+    METRICS.inc("api_requests", api=api)
+    METRICS.inc("api_bytes_received", n_bytes, api=api)
+    METRICS.observe("api_request_seconds", seconds, api=api)
+    if status >= 400:
+        METRICS.inc("api_errors", api=api, status=status)
+
+
+def record_session_response(response, *args, **kwargs):
+    # requests response hook, for AuthorizedSession users (gspread, async)
+    record_response(
+        urlsplit(response.url).hostname,
+        response.status_code,
+        len(response.content),
+        response.elapsed.total_seconds(),
+    )
+
+
+class DiscoveryFileCache:
+    """On-disk discovery documents, for apis not bundled with googleapiclient
+
+    Implements googleapiclient's discovery_cache Cache interface (get/set).
+    """
+
+    def __init__(self, max_age: int = 86400 * 7):
+        self.dirpath = get_state_dirpath() / "discovery"
+        self.dirpath.mkdir(exist_ok=True)
+        self.max_age = max_age
+
+    def filepath(self, url: str) -> Path:
+        return self.dirpath / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+
+    def get(self, url):
+        filepath = self.filepath(url)
+        if filepath.is_file() and time.time() - filepath.stat().st_mtime < self.max_age:
+            return filepath.read_text()
+        return None
+
+    def set(self, url, content):
+        self.filepath(url).write_text(content)
+
+
+class ThreadLocalHttp:
+    """httplib2-compatible transport with one AuthorizedHttp per thread.
+
+    httplib2.Http is not thread-safe. Building services on this instead of
+    bare credentials lets worker threads share a service: each thread keeps
+    its own keep-alive connection, opened on first use and then reused.
+    """
+
+    # checked by EmailClient before it lists from a second thread
+    thread_safe = True
+
+    def __init__(self, credentials: Credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def get_http(self) -> "google_auth_httplib2.AuthorizedHttp":
+        http = getattr(self.local, "http", None)
+        if http is None:
+            import google_auth_httplib2
+            import httplib2
+
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http()
+            )
+            self.local.http = http
+        return http
+
+    def request(self, uri, *args, **kwargs):
+        t0 = time.perf_counter()
+        resp, content = self.get_http().request(uri, *args, **kwargs)
+        seconds = time.perf_counter() - t0
+        record_response(urlsplit(uri).hostname, resp.status, len(content), seconds)
+        return resp, content
+
+    def __getattr__(self, name):
+        # timeout, redirect_codes and the like, read by googleapiclient
+        return getattr(self.get_http(), name)
+
+
+class AuthorizationRequiredError(Exception):
+    """No usable token.json, and the browser login is not allowed here"""
+
+
+class ServiceRegistry:
+    """Process-wide credentials and api clients, keyed by token file.
+
+    Every GoogleAuthManager for the same token shares one Credentials object
+    (loaded and refreshed once) and one client per api. Loading, refreshing
+    and building happen under a lock per token file, so one account with a
+    slow refresh doesn't hold up the others; `lock` only guards the dicts.
+    """
+
     def __init__(self):
+        self.lock = threading.RLock()
+        self.token_locks: dict[Path, threading.RLock] = {}
+        self.creds: dict[Path, Credentials] = {}
+        self.clients: dict[tuple, Any] = {}
+
+    def token_lock(self, token_file: Path) -> threading.RLock:
+        with self.lock:
+            return self.token_locks.setdefault(token_file, threading.RLock())
+
+    def get_client(self, key: tuple, factory) -> Any:
+        # keys start with the token file
+        with self.token_lock(key[0]):
+            with self.lock:
+                client = self.clients.get(key)
+            if client is None:
+                client = factory()
+                with self.lock:
+                    self.clients[key] = client
+            return client
+
+    def clear(self) -> None:
+        with self.lock:
+            self.creds.clear()
+            self.clients.clear()
+
+    def drop(self, token_file: Path) -> None:
+        """Forget one account, so its next use reloads token.json"""
+        with self.lock:
+            self.creds.pop(token_file, None)
+            for key in [key for key in self.clients if key[0] == token_file]:
+                del self.clients[key]
+
+
+REGISTRY = ServiceRegistry()
+
+
+class GoogleAuthManager:
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        secrets_dirpath: Optional[Path] = None,
+        interactive: bool = True,
+    ):
+        """Without `interactive`, a missing or unrefreshable token raises
+        AuthorizationRequiredError instead of opening the browser login,
+        which would block an unattended process (e.g. the daemon) for good.
+        """
         self.lg = CustomLogger(name=APP_NAME).getLogger()
+        self.pool_size = pool_size
+        self.interactive = interactive
         self.emails = []
-        self.secrets_dirpath = Path(__file__).parent / "secrets"
+        # one directory (client secret + token.json) per google account
+        if secrets_dirpath is None:
+            secrets_dirpath = Path(__file__).parent / "secrets"
+        self.secrets_dirpath = Path(secrets_dirpath)
         self.creds_file = self.get_credentials_json(self.secrets_dirpath)
         self.token_file = self.secrets_dirpath / "token.json"
 
@@ -32,6 +195,39 @@ class GoogleAuthManager:
         self.lg.debug("google cred initialized")
 
     def get_google_credentials(self):
+        with REGISTRY.token_lock(self.token_file):
+            creds = REGISTRY.creds.get(self.token_file)
+            if creds is None:
+                creds = self.load_google_credentials()
+                with REGISTRY.lock:
+                    REGISTRY.creds[self.token_file] = creds
+            self.ensure_fresh(creds)
+        return creds
+
+    def ensure_fresh(
+        self, creds: Optional[Credentials] = None, margin: timedelta = REFRESH_MARGIN
+    ) -> None:
+        """Refresh the access token if it expires within `margin`"""
+        creds = self.creds if creds is None else creds
+        if creds.expiry is None or creds.refresh_token is None:
+            return
+        # google-auth keeps expiry as naive utc
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with REGISTRY.token_lock(self.token_file):
+            if creds.expiry - now > margin:
+                return
+            try:
+                creds.refresh(Request())
+                self.save_token(creds)
+                self.lg.debug(f"token refreshed, expires {creds.expiry}")
+            except g_exceptions.RefreshError as e:
+                self.lg.error(f"refresh error. try deleting token. {e=}")
+
+    def save_token(self, creds: Credentials) -> None:
+        with open(self.token_file, "w") as token:
+            token.write(creds.to_json())
+
+    def load_google_credentials(self):
         creds = None
 
         # The file token.json stores the user's access and refresh tokens, and is
@@ -48,24 +244,95 @@ class GoogleAuthManager:
                 except g_exceptions.RefreshError as e:
                     # raise e
                     self.lg.error(f"refresh error. try deleting token. {e=}")
+                    if not self.interactive:
+                        raise AuthorizationRequiredError(
+                            f"token in {self.secrets_dirpath} can't be refreshed"
+                        ) from e
+            elif not self.interactive:
+                raise AuthorizationRequiredError(
+                    f"no valid token in {self.secrets_dirpath}; log in with"
+                    f" `python ggrd/auth.py {self.secrets_dirpath}`"
+                )
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.creds_file, self.SCOPES
                 )
                 creds = flow.run_local_server(port=0)
 
             # Save the credentials for the next run
-            with open(self.token_file, "w") as token:
-                token.write(creds.to_json())
+            self.save_token(creds)
         return creds
 
+    def get_service(self, api: str, version: str):
+        """Shared api client; discovery comes from the bundled documents"""
+        self.ensure_fresh()
+
+        def factory():
+            from googleapiclient.discovery import build
+            from googleapiclient.errors import UnknownApiNameOrVersion
+
+            http = ThreadLocalHttp(self.creds)
+            try:
+                return build(api, version, http=http, static_discovery=True)
+            except UnknownApiNameOrVersion:
+                return build(
+                    api,
+                    version,
+                    http=http,
+                    static_discovery=False,
+                    cache=DiscoveryFileCache(),
+                )
+
+        return REGISTRY.get_client((self.token_file, api, version), factory)
+
     def get_gmail_service(self):
-        """Shows basic usage of the Gmail API.
-        Lists the user's Gmail labels.
+        return self.get_service("gmail", "v1")
+
+    def get_authorized_session(
+        self, pool_size: Optional[int] = None
+    ) -> AuthorizedSession:
+        """Shared requests session with a keep-alive pool of `pool_size`.
+
+        Safe to use from many threads at once; up to `pool_size` connections
+        per host stay open between calls.
+        """
+        pool_size = self.pool_size if pool_size is None else pool_size
+        self.ensure_fresh()
+
+        def factory():
+            session = AuthorizedSession(self.creds)
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.hooks["response"].append(record_session_response)
+            return session
+
+        return REGISTRY.get_client((self.token_file, "session", pool_size), factory)
+
+    def has_messages_added(self, start_history_id: str) -> bool:
+        """Whether any message was added to the mailbox after `start_history_id`.
+
+        One users.history.list call (messageAdded only, maxResults=1) over the
+        plain requests session, so neither googleapiclient nor its discovery
+        document is loaded. An expired start id (404) counts as yes.
         """
-        # Build the Gmail API service
-        service = build("gmail", "v1", credentials=self.creds)
-        return service
+        session = self.get_authorized_session()
+        response = session.get(
+            GMAIL_HISTORY_URL,
+            params={
+                "startHistoryId": start_history_id,
+                "historyTypes": "messageAdded",
+                "maxResults": 1,
+                "fields": "history/id,nextPageToken",
+            },
+            timeout=30,
+        )
+        if response.status_code == 404:
+            return True
+        response.raise_for_status()
+        body = response.json()
+        return bool(body.get("history") or body.get("nextPageToken"))
 
     def get_credentials_json(self, secrets_dirpath: Path) -> Path:
         json_file = None
@@ -80,18 +347,28 @@ class GoogleAuthManager:
 
     def get_sheets_service(self):
         ## Original implementation without gspread library dependencies
-        service = build("sheets", "v4", credentials=self.creds)
-        return service
+        return self.get_service("sheets", "v4")
+
+    def get_gspread(self) -> "gspread.Client":
+        # authorize with the shared creds instead of gspread.oauth re-reading
+        # token.json and refreshing on its own; the pooled session lets
+        # worksheet calls run from worker threads
+        import gspread
 
-    def get_gspread(self):
-        return gspread.oauth(
-            credentials_filename=self.creds_file,
-            authorized_user_filename=self.token_file,
+        self.ensure_fresh()
+        return REGISTRY.get_client(
+            (self.token_file, "gspread"),
+            lambda: gspread.authorize(
+                self.creds, session=self.get_authorized_session()
+            ),
         )
 
 
 def main():
-    gam = GoogleAuthManager()
+    import sys
+
+    # logs in (browser flow) and writes token.json in the given secrets dir
+    gam = GoogleAuthManager(secrets_dirpath=sys.argv[1] if len(sys.argv) > 1 else None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    from utils import CustomLogger, get_state_dirpath
+except ImportError:
+    from ggrd.utils import CustomLogger, get_state_dirpath
+
+APP_NAME = "ggrd"
+
+
+class MessageCache:
+    """On-disk cache of raw gmail messages and their parsed records.
+
+    Confirmation emails never change once sent, so a message id maps to the
+    same payload forever. Parsed records are stamped with the parser name and
+    version, and a record from an older parser version counts as a miss.
+    """
+
+    def __init__(
+        self,
+        filepath: Optional[Path] = None,
+        max_entries: int = 100_000,
+        max_age_days: int = 0,
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        if filepath is None:
+            filepath = get_state_dirpath() / f"{APP_NAME}-messages.sqlite3"
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.filepath, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    message_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_fetched_at
+                    ON messages (fetched_at);
+                CREATE TABLE IF NOT EXISTS records (
+                    message_id TEXT NOT NULL,
+                    parser TEXT NOT NULL,
+                    parser_version INTEGER NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (message_id, parser)
+                );
+                """)
+        self.evict()
+        self.lg.debug(f"message cache loaded - {self.filepath}")
+
+    def get_payload(self, message_id: str) -> Optional[dict]:
+        return self.get_payloads([message_id]).get(message_id)
+
+    def get_payloads(self, message_ids: list[str]) -> dict[str, dict]:
+        payloads = {}
+        with self.lock:
+            # stay well below sqlite's bound-parameter limit
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i : i + 500]
+                rows = self.conn.execute(
+                    "SELECT message_id, payload FROM messages"
+                    f" WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for message_id, payload in rows:
+                    payloads[message_id] = json.loads(payload)
+        return payloads
+
+    def put_payloads(self, msgs: dict[str, dict]) -> None:
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+                [(mid, json.dumps(msg), now) for mid, msg in msgs.items()],
+            )
+
+    def iter_payloads(self, chunk_size: int = 500) -> Iterator[dict]:
+        # keyset pages, so only one chunk of payloads is in memory at a time
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT rowid, payload FROM messages WHERE rowid > ?"
+                    " ORDER BY rowid LIMIT ?",
+                    (last_rowid, chunk_size),
+                ).fetchall()
+            if not rows:
+                return
+            for last_rowid, payload in rows:
+                yield json.loads(payload)
+
+    def get_record(
+        self, message_id: str, parser: str, parser_version: int
+    ) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT record FROM records"
+                " WHERE message_id = ? AND parser = ? AND parser_version = ?",
+                (message_id, parser, parser_version),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_record(
+        self, message_id: str, parser: str, parser_version: int, record: dict
+    ) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                (message_id, parser, parser_version, json.dumps(record)),
+            )
+
+    def evict(self) -> int:
+        """Drop entries past `max_age_days`, then the oldest past `max_entries`"""
+        with self.lock, self.conn:
+            n = 0
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                n += self.conn.execute(
+                    "DELETE FROM messages WHERE fetched_at < ?", (cutoff,)
+                ).rowcount
+            if self.max_entries:
+                n += self.conn.execute(
+                    "DELETE FROM messages WHERE message_id NOT IN ("
+                    " SELECT message_id FROM messages"
+                    " ORDER BY fetched_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                ).rowcount
+            if n:
+                self.conn.execute(
+                    "DELETE FROM records"
+                    " WHERE message_id NOT IN (SELECT message_id FROM messages)"
+                )
+                self.lg.info(f"evicted {n} cached messages")
+        return n
+
+    def close(self) -> None:
+        self.conn.close()
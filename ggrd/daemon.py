@@ -0,0 +1,254 @@
+import dataclasses
+import heapq
+import json
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    from auth import REGISTRY, GoogleAuthManager
+    from metrics import METRICS
+    from outpost import Outpost
+    from utils import CustomLogger
+except ImportError:
+    from ggrd.auth import REGISTRY, GoogleAuthManager
+    from ggrd.metrics import METRICS
+    from ggrd.outpost import Outpost
+    from ggrd.utils import CustomLogger
+
+APP_NAME = "ggrd"
+MIN_INTERVAL = 60.0  # seconds
+MAX_INTERVAL = 3600.0
+
+
+@dataclasses.dataclass
+class AccountConfig:
+    name: str
+    secrets_dirpath: Optional[str] = None  # None is ggrd/secrets
+    spreadsheet_name: Optional[str] = None  # None is the default sheet
+
+
+def load_accounts(filepath: Path) -> list[AccountConfig]:
+    """Accounts from a json list of AccountConfig fields"""
+    with open(filepath, "r") as fp:
+        accounts = [AccountConfig(**item) for item in json.load(fp)]
+    names = [account.name for account in accounts]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        # the name keys each account's checkpoint and message cache
+        raise ValueError(f"duplicate account names in {filepath}; {duplicates=}")
+    return accounts
+
+
+def make_outpost(account: AccountConfig) -> Outpost:
+    # no browser login from here; a missing token fails just this job
+    gga = GoogleAuthManager(secrets_dirpath=account.secrets_dirpath, interactive=False)
+    return Outpost(
+        gga=gga, spreadsheet_name=account.spreadsheet_name, account=account.name
+    )
+
+
+def make_default_outpost(account: AccountConfig) -> Outpost:
+    # no account key: the same checkpoint and message cache as `cli.py pull`,
+    # so moving from cron to the daemon carries on where cron left off
+    gga = GoogleAuthManager(secrets_dirpath=account.secrets_dirpath, interactive=False)
+    return Outpost(gga=gga, spreadsheet_name=account.spreadsheet_name)
+
+
+class AdaptiveInterval:
+    """Poll interval that follows the mail arrival rate.
+
+    The rate is an exponentially weighted moving average of new emails per
+    second, and the interval aims for about `target` new emails per poll.
+    Busy accounts are polled often and quiet ones drift to `max_interval`.
+    Failures back off exponentially instead.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        target: float = 1.0,
+        alpha: float = 0.3,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.alpha = alpha
+        self.rate = 0.0
+        self.interval = min_interval
+        self.failures = 0
+
+    def observe(self, n_new: int, elapsed: float) -> float:
+        self.failures = 0
+        if elapsed > 0:
+            self.rate = self.alpha * n_new / elapsed + (1 - self.alpha) * self.rate
+        interval = self.target / self.rate if self.rate > 0 else self.interval * 2
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        return self.interval
+
+    def failed(self) -> float:
+        self.failures += 1
+        return min(self.min_interval * 2**self.failures, self.max_interval)
+
+
+class Job:
+    """One account's Outpost, kept warm between polls.
+
+    Clients are built on the first poll, in the job's own thread, so a bad
+    token fails only this job. After `reset_after` failures in a row they
+    are dropped and rebuilt from disk on the next try. A new account (see
+    Outpost.is_new) gets a full reset_data instead of a pull.
+    """
+
+    def __init__(
+        self,
+        account: AccountConfig,
+        factory: Callable[[AccountConfig], Outpost] = make_outpost,
+        schedule: Optional[AdaptiveInterval] = None,
+        reset_after: int = 3,
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        self.account = account
+        self.factory = factory
+        self.schedule = AdaptiveInterval() if schedule is None else schedule
+        self.reset_after = reset_after
+        self.outpost: Optional[Outpost] = None
+        self.last_poll: Optional[float] = None
+
+    @classmethod
+    def default(cls) -> "Job":
+        """The account in ggrd/secrets and the default sheet, as cli.py uses"""
+        return cls(AccountConfig(name="default"), factory=make_default_outpost)
+
+    def run_once(self) -> float:
+        """Poll once; returns the delay in seconds until the next poll"""
+        name = self.account.name
+        now = time.monotonic()
+        try:
+            if self.outpost is None:
+                self.outpost = self.factory(self.account)
+            gga = self.built("gga")
+            if gga is not None:
+                gga.ensure_fresh()
+            if self.outpost.is_new():
+                self.lg.info(f"[{name}] new account; building the sheet")
+                n_new = self.outpost.reset_data()
+            else:
+                n_new = self.outpost.pull_updates_from_email(self_reset=False)
+        except Exception as e:
+            delay = self.schedule.failed()
+            self.lg.error(
+                f"[{name}] poll failed {self.schedule.failures}x,"
+                f" retry in {delay:.0f}s; {e=}"
+            )
+            if self.schedule.failures >= self.reset_after:
+                self.close()
+            return delay
+        elapsed = now - self.last_poll if self.last_poll is not None else 0.0
+        self.last_poll = now
+        delay = self.schedule.observe(n_new, elapsed)
+        self.lg.info(f"[{name}] {n_new} new bookings; next poll in {delay:.0f}s")
+        return delay
+
+    def built(self, name: str):
+        """Outpost client `name` if it was given or already built, else None.
+
+        They are cached_propertys; reading one that failed to build would
+        run its constructor again, e.g. in run_once's except block.
+        """
+        if self.outpost is None:
+            return None
+        return vars(self.outpost).get(name)
+
+    def close(self) -> None:
+        gga, email = self.built("gga"), self.built("email")
+        # forgotten first, so the next poll starts afresh even if closing fails
+        self.outpost = None
+        if gga is not None:
+            REGISTRY.drop(gga.token_file)
+        if email is not None:
+            email.close()
+
+
+class Daemon:
+    """Runs jobs on their own schedules, up to `max_workers` at once.
+
+    With `report_dir`, the metrics reports are rewritten after every poll;
+    they are cumulative since the daemon started.
+    """
+
+    def __init__(
+        self, jobs: list[Job], max_workers: int = 4, report_dir: Optional[Path] = None
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        self.jobs = jobs
+        self.max_workers = max_workers
+        self.report_dir = report_dir
+        self.stop = threading.Event()
+
+    def run(self) -> None:
+        due = [(time.monotonic(), i) for i in range(len(self.jobs))]
+        heapq.heapify(due)
+        running: dict[Future, int] = {}
+        with ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix=f"{APP_NAME}-job"
+        ) as executor:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                while due and due[0][0] <= now and len(running) < self.max_workers:
+                    _, i = heapq.heappop(due)
+                    running[executor.submit(self.jobs[i].run_once)] = i
+                # wake at least once a second to notice `stop`
+                timeout = 1.0
+                if due and len(running) < self.max_workers:
+                    timeout = min(timeout, max(0.0, due[0][0] - now))
+                if not running:
+                    self.stop.wait(timeout)
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        delay = future.result()
+                    except Exception as e:
+                        # run_once catches poll errors; this one escaped it, and
+                        # must not stop the loop for every other account
+                        job = self.jobs[i]
+                        delay = job.schedule.failed()
+                        self.lg.error(
+                            f"[{job.account.name}] job crashed,"
+                            f" retry in {delay:.0f}s; {e=}"
+                        )
+                    heapq.heappush(due, (time.monotonic() + delay, i))
+                if done and self.report_dir is not None:
+                    METRICS.write_reports(self.report_dir)
+            self.lg.info(f"stopping; waiting for {len(running)} running jobs")
+        for job in self.jobs:
+            try:
+                job.close()
+            except Exception as e:
+                self.lg.error(f"[{job.account.name}] close failed; {e=}")
+
+    def run_forever(self) -> None:
+        """run() until SIGINT or SIGTERM"""
+
+        def handle_signal(signum, frame):
+            self.lg.info(f"received signal {signum}")
+            self.stop.set()
+
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+        self.lg.info(f"daemon started with {len(self.jobs)} accounts")
+        self.run()
+
+
+def main():
+    Daemon([Job.default()]).run_forever()
+
+
+if __name__ == "__main__":
+    main()
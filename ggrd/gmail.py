@@ -1,19 +1,284 @@
 import base64
 import dataclasses
 import os
-import tempfile
-from typing import Optional
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from typing import Any, Callable, Iterator, Optional
 
+import httplib2
 import pandas as pd
+from googleapiclient.errors import HttpError
 
 try:
     from auth import GoogleAuthManager
+    from cache import MessageCache
+    from metrics import METRICS
     from utils import CustomLogger
 except ImportError:
     from ggrd.auth import GoogleAuthManager
+    from ggrd.cache import MessageCache
+    from ggrd.metrics import METRICS
     from ggrd.utils import CustomLogger
 
 APP_NAME = "ggrd"
+MAX_BATCH_SIZE = 100  # gmail api recommends no more than 100 calls per batch
+MAX_PAGE_SIZE = 500  # maxResults upper bound for messages.list
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+# googleapiclient retries 429/5xx/rate-limit 403s itself, with exponential backoff
+NUM_RETRIES = 5
+# partial responses: phase one of a two-phase fetch reads just what `matches`
+# needs; full fetches skip threadId, labelIds, snippet, sizeEstimate, ...
+# Content-Type rides along because BODY_FIELDS drops the top-level headers,
+# and a single-part body needs its charset (see part_charset)
+METADATA_HEADERS = ["From", "Subject", "Content-Type"]
+METADATA_FIELDS = "id,internalDate,payload/headers"
+FULL_FIELDS = "id,internalDate,payload(mimeType,headers,body,parts)"
+BODY_FIELDS = "id,internalDate,payload(mimeType,body,parts)"
+BODY_MIME_TYPES = ("text/html", "text/plain")  # in order of preference
+OUTPOST_DATETIME_FMT = "%d %b %Y @ %I:%M %p"  # e.g. 26 May 2024 @ 09:00 PM
+OUTPOST_KWS = {
+    "Date & time": "datetime",
+    "Booking ref": "booking_ref",
+    "Membership No": "membership_no",
+    "Membership": "membership_name",
+    "Class": "class_name",
+    "Location": "location",
+}
+# sheets hold class dates, and a class can be booked this far ahead; a date
+# query picking up from a sheet starts this much earlier so no
+# confirmation sent before the latest class is missed
+BOOKING_LEAD_TIME = timedelta(days=30)
+# low-cardinality text columns, stored once per distinct value
+CATEGORY_COLUMNS = ["membership_name", "class_name", "location"]
+
+
+class HistoryExpiredError(Exception):
+    """The startHistoryId is too old for users.history.list (HTTP 404)"""
+
+
+class FetchError(Exception):
+    """Messages that could not be fetched, even after retries"""
+
+    def __init__(self, message_ids: list[str]):
+        super().__init__(f"{len(message_ids)} messages failed to fetch")
+        self.message_ids = message_ids
+
+
+def get_header(msg: dict, name: str, default: str = "") -> str:
+    headers = msg["payload"].get("headers", [])
+    return next(
+        (header["value"] for header in headers if header["name"] == name), default
+    )
+
+
+def walk_parts(part: dict) -> Iterator[dict]:
+    """Depth-first walk over a MIME tree, starting with `part` itself"""
+    yield part
+    for child in part.get("parts", []):
+        yield from walk_parts(child)
+
+
+def is_attachment(part: dict) -> bool:
+    return bool(part.get("filename"))
+
+
+def find_body_part(
+    payload: dict, mime_types: tuple = BODY_MIME_TYPES
+) -> Optional[dict]:
+    """The best body part at any depth, e.g. inside multipart/alternative.
+
+    Stops at the first part of the preferred type; otherwise returns the
+    first part of the next best type found.
+    """
+    best, best_rank = None, len(mime_types)
+    for part in walk_parts(payload):
+        if is_attachment(part) or part.get("mimeType") not in mime_types:
+            continue
+        rank = mime_types.index(part["mimeType"])
+        if rank == 0:
+            return part
+        if rank < best_rank:
+            best, best_rank = part, rank
+    return best
+
+
+def part_charset(part: dict) -> str:
+    content_type = next(
+        (
+            header["value"]
+            for header in part.get("headers", [])
+            if header["name"].lower() == "content-type"
+        ),
+        "",
+    )
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "charset":
+            return value.strip('"')
+    return "utf-8"
+
+
+def decode_part(part: dict) -> Optional[str]:
+    """Text of a part, or None if its data is still behind an attachmentId"""
+    data = part.get("body", {}).get("data")
+    if data is None:
+        return None
+    raw = base64.urlsafe_b64decode(data)
+    try:
+        return raw.decode(part_charset(part), errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def internal_date(msg: dict) -> int:
+    return int(msg.get("internalDate", 0))
+
+
+def timed_call(func: Callable, *args) -> tuple[Any, float]:
+    """func(*args) and how long it took. Pool workers can't update the
+    parent's METRICS, so they send the timing back with the result."""
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def is_retryable_status(status: int, content) -> bool:
+    if status in RETRYABLE_STATUS:
+        return True
+    if status == 403:
+        return any(reason in str(content) for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+def is_retryable(error: Exception) -> bool:
+    # a dropped connection or a timeout is as transient as a 503
+    if isinstance(error, (OSError, httplib2.HttpLib2Error)):
+        return True
+    if not isinstance(error, HttpError):
+        return False
+    return is_retryable_status(error.resp.status, error.content)
+
+
+class _KeyValueRowParser(HTMLParser):
+    """Single pass over html, keeping `<tr>` rows whose first cell is a key.
+
+    Text is collected into the innermost open cell, so layout tables nested
+    around the data table do not swallow its rows. Stops as soon as every key
+    has been seen.
+    """
+
+    class Done(Exception):
+        pass
+
+    def __init__(self, keys):
+        super().__init__(convert_charrefs=True)
+        self.keys = keys
+        self.found: dict[str, str] = {}
+        self.rows: list[tuple[int, list[str]]] = []  # (cell depth at <tr>, cells)
+        self.cells: list[list[str]] = []
+
+    def close_cell(self) -> None:
+        text = " ".join("".join(self.cells.pop()).split())
+        if self.rows:
+            self.rows[-1][1].append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append((len(self.cells), []))
+        elif tag in ("td", "th"):
+            if self.rows and len(self.cells) > self.rows[-1][0]:
+                self.close_cell()  # previous cell left unclosed
+            self.cells.append([])
+        elif tag == "br" and self.cells:
+            self.cells[-1].append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self.cells:
+            self.close_cell()
+        elif tag == "tr" and self.rows:
+            while len(self.cells) > self.rows[-1][0]:
+                self.close_cell()
+            _, row = self.rows.pop()
+            if len(row) >= 2 and row[0] in self.keys and row[0] not in self.found:
+                self.found[row[0]] = row[1]
+                if len(self.found) == len(self.keys):
+                    raise self.Done
+
+    def handle_data(self, data):
+        if self.cells:
+            self.cells[-1].append(data)
+
+
+def parse_key_value_html(html_str: str, keys) -> dict[str, str]:
+    parser = _KeyValueRowParser(keys)
+    try:
+        parser.feed(html_str)
+        parser.close()
+    except _KeyValueRowParser.Done:
+        pass
+    return parser.found
+
+
+@dataclasses.dataclass
+class AttachmentRef:
+    """An attachment left on the server; see EmailClient.load_attachment"""
+
+    message_id: str
+    attachment_id: str
+    filename: str
+    mime_type: str
+    size: int = 0
+
+
+def list_attachments(msg: dict) -> list[AttachmentRef]:
+    return [
+        AttachmentRef(
+            message_id=msg.get("id", ""),
+            attachment_id=part["body"]["attachmentId"],
+            filename=part["filename"],
+            mime_type=part.get("mimeType", ""),
+            size=part["body"].get("size", 0),
+        )
+        for part in walk_parts(msg["payload"])
+        if is_attachment(part) and "attachmentId" in part.get("body", {})
+    ]
+
+
+@dataclasses.dataclass(slots=True)
+class BookingRecord:
+    """One booking, with the date as written in the email.
+
+    Dates are parsed for a whole batch at once in bookings_frame.
+    """
+
+    datetime: str
+    booking_ref: str
+    membership_no: str
+    membership_name: str
+    class_name: str
+    location: str
+
+
+BOOKING_COLUMNS = [field.name for field in dataclasses.fields(BookingRecord)]
+
+
+def bookings_frame(records: list[BookingRecord]) -> pd.DataFrame:
+    """Build the DataFrame once, column by column, with vectorized dates.
+
+    Unparseable dates come out as NaT.
+    """
+    df = pd.DataFrame(
+        {name: [getattr(r, name) for r in records] for name in BOOKING_COLUMNS}
+    )
+    df["datetime"] = pd.to_datetime(
+        df["datetime"], format=OUTPOST_DATETIME_FMT, errors="coerce"
+    )
+    for name in CATEGORY_COLUMNS:
+        df[name] = df[name].astype("category")
+    return df
 
 
 @dataclasses.dataclass
@@ -21,7 +286,10 @@ class EmailContent:
     sender: str
     subject: str
     body_text: str
-    df: Optional[pd.DataFrame] = None
+    record: Optional[BookingRecord] = None
+    message_id: str = ""
+    attachments: list[AttachmentRef] = dataclasses.field(default_factory=list)
+    source: str = ""  # name of the EmailParser that produced `record`
 
     def __post_init__(self, preview_length: int = 50):
         self.body_preview = (
@@ -31,14 +299,162 @@ class EmailContent:
         )
 
 
+def decode_message(msg: dict) -> EmailContent:
+    subject = get_header(msg, "Subject", "No Subject")
+    sender = get_header(msg, "From", "No Sender")
+
+    # Get the content of the email
+    payload = msg["payload"]
+    part = find_body_part(payload)
+    if part is None and "parts" not in payload:
+        # a single-part email of some other type; take it as it is
+        part = payload
+    decoded_body = decode_part(part) if part is not None else None
+    body = decoded_body if decoded_body is not None else "No Body"
+
+    return EmailContent(
+        sender=sender,
+        subject=subject,
+        body_text=body,
+        message_id=msg.get("id", ""),
+        attachments=list_attachments(msg),
+    )
+
+
+def parse_outpost_html(
+    html_str: str, kws: dict = OUTPOST_KWS
+) -> Optional[BookingRecord]:
+    """Booking record with fields named by `kws` values; None if any are missing"""
+    found = parse_key_value_html(html_str, kws)
+    if len(found) < len(kws):
+        return None
+    return BookingRecord(**{kws[key]: value for key, value in found.items()})
+
+
+@dataclasses.dataclass(frozen=True)
+class EmailParser:
+    """One source of records: which emails it takes and how it reads them.
+
+    `extract` turns a body into a record, or None; it runs in pool workers,
+    so it must be a module-level function. Records go to the worksheet
+    `sheet_name`, deduplicated on the `key` column. Bump `version` whenever
+    `extract` output changes, so cached records are parsed again.
+    """
+
+    name: str
+    sender_email: str
+    subject: str
+    extract: Callable[[str], Any]
+    sheet_name: str = "data"
+    key: str = "booking_ref"
+    version: int = 1
+    record_type: type = dict
+    to_frame: Callable[[list], pd.DataFrame] = pd.DataFrame.from_records
+
+    def matches(self, msg: dict) -> bool:
+        sender = get_header(msg, "From")
+        subject = get_header(msg, "Subject")
+        return self.sender_email in sender and subject.startswith(self.subject)
+
+    def query(self) -> str:
+        subject = self.subject.replace('"', "")
+        return f'(from:{self.sender_email} subject:"{subject}")'
+
+    def frame(self, records: list) -> pd.DataFrame:
+        """`records` as one DataFrame, oldest first, bad dates dropped"""
+        df = self.to_frame(records)
+        if "datetime" in df.columns:
+            n_invalid = int(df["datetime"].isna().sum())
+            if n_invalid:
+                CustomLogger(name=APP_NAME).getLogger().warning(
+                    f"[{self.name}]: dropped {n_invalid} records"
+                    " with unparseable dates"
+                )
+                df = df.dropna(subset=["datetime"])
+            df = df.sort_values(by="datetime")
+            df.reset_index(drop=True, inplace=True)
+        return df
+
+
+PARSERS: dict[str, EmailParser] = {}
+
+
+def register_parser(parser: EmailParser) -> EmailParser:
+    PARSERS[parser.name] = parser
+    return parser
+
+
+def decode_with_parser(msg: dict, parser: EmailParser) -> EmailContent:
+    e = decode_message(msg)
+    e.record = parser.extract(e.body_text)
+    e.source = parser.name
+    return e
+
+
+OUTPOST_PARSER = register_parser(
+    EmailParser(
+        name="outpost",
+        sender_email="no-reply@outpostclimbing.rezeve.com",
+        subject="Booking confirmed:",
+        extract=parse_outpost_html,
+        version=3,
+        record_type=BookingRecord,
+        to_frame=bookings_frame,
+    )
+)
+
+
 class EmailClient:
-    def __init__(self):
+    def __init__(
+        self,
+        service=None,
+        batch_size: int = 0,
+        cache: Optional[MessageCache] = None,
+        cache_only: bool = False,
+        parse_workers: int = 0,
+        session=None,
+        gga: Optional[GoogleAuthManager] = None,
+    ):
         self.lg = CustomLogger(name=APP_NAME).getLogger()
         self.emails = []
-        self.gga = GoogleAuthManager()
-        self.service = self.gga.get_gmail_service()
+        if service is None:
+            self.gga = GoogleAuthManager() if gga is None else gga
+            self.service = self.gga.get_gmail_service()
+        else:
+            # e.g. a service built on googleapiclient.http.HttpMockSequence
+            self.gga = None
+            self.service = service
+        # requests-style session for AsyncEmailClient; None builds one from gga
+        self.session = session
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.cache = cache
+        # replay from the cache only; no gmail calls at all
+        self.cache_only = cache_only
+        if cache_only and cache is None:
+            raise ValueError("cache_only requires a cache")
+        # decode+parse on a process pool, leaving this thread free to fetch
+        self.parse_workers = parse_workers
+        self.executor: Optional[ProcessPoolExecutor] = None
         self.lg.info("gmail service loaded")
 
+    @staticmethod
+    def build_query(
+        sender_email: Optional[str] = None,
+        after_date: Optional[str] = None,
+        before_date: Optional[str] = None,
+        subject: Optional[str] = None,
+    ) -> str:
+        query_parts = []
+        if sender_email:
+            query_parts.append(f"from:{sender_email}")
+        if before_date:
+            query_parts.append(f"before:{before_date}")
+        if after_date:
+            query_parts.append(f"after:{after_date}")
+        if subject:
+            query_parts.append(f"subject:{subject}")
+        return " ".join(query_parts)
+
     def get_messages(
         self,
         user_id="me",
@@ -47,70 +463,469 @@ class EmailClient:
         before_date: Optional[str] = None,
         subject: Optional[str] = None,
         limit: int = 0,
+        batch_size: Optional[int] = None,
     ):
         try:
-            # Build a query string to filter messages by sender
-            query_parts = []
-            if sender_email:
-                query_parts.append(f"from:{sender_email}")
-            if before_date:
-                query_parts.append(f"before:{before_date}")
-            if after_date:
-                query_parts.append(f"after:{after_date}")
-            if subject:
-                query_parts.append(f"subject:{subject}")
-
-            query = " ".join(query_parts)
-
-            # Get a list of messages thatÏ match the query
-            response = (
-                self.service.users().messages().list(userId=user_id, q=query).execute()
+            if self.cache_only:
+                emails = self.iter_cached_messages(after_date=after_date)
+            else:
+                query = self.build_query(sender_email, after_date, before_date, subject)
+                emails = self.iter_messages(
+                    query, user_id=user_id, limit=limit, batch_size=batch_size
+                )
+            for e in emails:
+                self.emails.append(e)
+        except Exception as error:
+            self.lg.error(f"An error occurred after {len(self.emails)} emails: {error}")
+            raise error
+
+    def iter_messages(
+        self,
+        query: str = "",
+        page_size: int = MAX_PAGE_SIZE,
+        user_id="me",
+        limit: int = 0,
+        batch_size: Optional[int] = None,
+    ) -> Iterator[EmailContent]:
+        """Lazily yield every message matching `query`, across all pages.
+
+        The next page of ids is listed in the background while the current
+        page is being fetched and parsed.
+        """
+        jobs: list = []
+        for msgs in self.iter_raw_pages(query, page_size, user_id, limit, batch_size):
+            # this page parses on the pool while the previous one is yielded
+            next_jobs = self.submit_parse(msgs)
+            yield from self.collect_parsed(jobs)
+            jobs = next_jobs
+        yield from self.collect_parsed(jobs)
+
+    def iter_raw_pages(
+        self,
+        query: str = "",
+        page_size: int = MAX_PAGE_SIZE,
+        user_id="me",
+        limit: int = 0,
+        batch_size: Optional[int] = None,
+    ) -> Iterator[list[dict]]:
+        """Raw messages matching `query`, one list page at a time"""
+        batch_size = self.batch_size if batch_size is None else batch_size
+        count = 0
+        for message_ids in self.iter_message_pages(query, page_size, user_id):
+            if limit:
+                message_ids = message_ids[: limit - count]
+            yield self.fetch_messages(message_ids, user_id, batch_size)
+            count += len(message_ids)
+            if limit and count >= limit:
+                break
+
+    def iter_cached_messages(
+        self, after_date: Optional[str] = None
+    ) -> Iterator[EmailContent]:
+        """Replay cached messages accepted by `matches`.
+
+        Pages come in cache insertion order, not by date; only messages
+        within a page are newest first. Sort the records if order matters.
+        """
+        for msgs in self.iter_cached_pages(after_date):
+            yield from self.parse_messages(msgs)
+
+    def iter_cached_pages(
+        self, after_date: Optional[str] = None, page_size: int = MAX_PAGE_SIZE
+    ) -> Iterator[list[dict]]:
+        after_ms = 0
+        if after_date is not None:
+            dt = datetime.strptime(after_date.replace("-", "/"), "%Y/%m/%d")
+            after_ms = int(dt.timestamp() * 1000)
+        msgs = []
+        for msg in self.cache.iter_payloads():
+            if internal_date(msg) >= after_ms and self.matches(msg):
+                msgs.append(msg)
+            if len(msgs) == page_size:
+                yield msgs
+                msgs = []
+        if msgs:
+            yield msgs
+
+    def iter_message_pages(
+        self,
+        query: str = "",
+        page_size: int = MAX_PAGE_SIZE,
+        user_id="me",
+        prefetch: Optional[bool] = None,
+    ) -> Iterator[list[str]]:
+        """Message ids matching `query`, a messages.list page at a time.
+
+        With `prefetch`, the next page is listed on a second thread while the
+        caller fetches this one. That needs a transport safe to share across
+        threads, so by default it is only on for one that says so (e.g.
+        auth.ThreadLocalHttp); recorded transports such as HttpMockSequence
+        answer in call order and are listed inline.
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        if prefetch is None:
+            http = getattr(self.service, "_http", None)
+            prefetch = getattr(http, "thread_safe", False)
+
+        def list_page(page_token: Optional[str]) -> dict:
+            request = (
+                self.service.users()
+                .messages()
+                .list(
+                    userId=user_id, q=query, maxResults=page_size, pageToken=page_token
+                )
             )
-            messages = response.get("messages", [])
+            with METRICS.timer("stage", stage="gmail_list"):
+                return request.execute(num_retries=NUM_RETRIES)
 
-            # Print the subject and sender of each message
-            for i, message in enumerate(messages, 1):
-                e = self.get_message(message_id=message["id"], user_id=user_id)
-                self.emails.append(e)
-                if limit:
-                    if i >= limit:
-                        break
+        if not prefetch:
+            page_token = None
+            while True:
+                response = list_page(page_token)
+                page_token = response.get("nextPageToken")
+                yield [message["id"] for message in response.get("messages", [])]
+                if not page_token:
+                    return
 
-        except Exception as error:
-            self.lg.info(f"An error occurred: {error}")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(list_page, None)
+            while future is not None:
+                response = future.result()
+                page_token = response.get("nextPageToken")
+                future = executor.submit(list_page, page_token) if page_token else None
+                yield [message["id"] for message in response.get("messages", [])]
 
-    def get_message(self, message_id, user_id="me") -> EmailContent:
-        msg = (
-            self.service.users().messages().get(userId=user_id, id=message_id).execute()
+    def fetch_messages(
+        self, message_ids: list[str], user_id="me", batch_size: int = 0
+    ) -> list[dict]:
+        if batch_size:
+            msgs = self.fetch_messages_batch(
+                message_ids, user_id=user_id, batch_size=batch_size
+            )
+            return [msgs[mid] for mid in message_ids if mid in msgs]
+        return [self.fetch_message(mid, user_id=user_id) for mid in message_ids]
+
+    def submit_parse(self, msgs: list[dict]) -> list:
+        """Start parsing a page of raw messages, newest first like gmail.
+
+        Returns (msg, result) jobs for `collect_parsed`, where the result is an
+        EmailContent from `load_parsed`, a Future on the pool, or None.
+        """
+        msgs = sorted(msgs, key=lambda msg: (internal_date(msg), msg["id"]))
+        jobs = []
+        for msg in reversed(msgs):
+            result = self.load_parsed(msg)
+            if result is None:
+                msg = self.resolve_body(msg)
+            if result is None and self.parse_workers:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(self.parse_workers)
+                result = self.executor.submit(timed_call, *self.decode_call(msg))
+            jobs.append((msg, result))
+        return jobs
+
+    def collect_parsed(self, jobs: list) -> Iterator[EmailContent]:
+        for msg, result in jobs:
+            try:
+                if isinstance(result, Future):
+                    result, seconds = result.result()
+                    METRICS.observe("parse_seconds", seconds)
+                    self.save_parsed(result)
+                elif result is None:
+                    result = self.parse_message(msg)
+                else:
+                    METRICS.inc("parse_cache_hits")
+            except Exception as e:
+                # one bad email shouldn't cost the rest of the run
+                self.lg.error(f"parse failed, message_id={msg.get('id')}; {e=}")
+                METRICS.inc("parse_errors")
+                continue
+            METRICS.inc("messages_parsed")
+            yield result
+
+    def parse_messages(self, msgs: list[dict]) -> Iterator[EmailContent]:
+        return self.collect_parsed(self.submit_parse(msgs))
+
+    def to_frame(self, records: list) -> pd.DataFrame:
+        """One DataFrame for a batch of parsed records"""
+        return pd.DataFrame.from_records(records)
+
+    def fetch_messages_batch(
+        self,
+        message_ids: list[str],
+        user_id="me",
+        batch_size: int = MAX_BATCH_SIZE,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+    ) -> dict[str, dict]:
+        """Fetch raw messages with batch requests of up to `batch_size` calls.
+
+        Items that fail with a retryable error (429, 5xx, rate limit), or sit
+        in a batch request that failed as a whole, are retried on their own,
+        with exponential backoff between rounds.
+        """
+        pending = list(dict.fromkeys(message_ids))
+        results: dict[str, dict] = {}
+        if self.cache is not None:
+            results = self.cache.get_payloads(pending)
+            pending = [mid for mid in pending if mid not in results]
+            if self.cache_only:
+                self.lg.warning(f"{len(pending)} messages not in cache")
+                return results
+        fetched, failed = self.execute_batch(
+            pending, user_id, batch_size, max_retries, backoff, fields=FULL_FIELDS
         )
-        headers = msg["payload"]["headers"]
-        subject = next(
-            (header["value"] for header in headers if header["name"] == "Subject"),
-            "No Subject",
+        if self.cache is not None and fetched:
+            self.cache.put_payloads(fetched)
+        if failed:
+            raise FetchError(failed)
+        results.update(fetched)
+        return results
+
+    def fetch_matching_batch(
+        self, message_ids: list[str], user_id="me", batch_size: int = MAX_BATCH_SIZE
+    ) -> dict[str, dict]:
+        """Two-phase fetch of the messages accepted by `matches`.
+
+        Phase one gets only the METADATA_HEADERS of unknown messages, so
+        anything `matches` rejects costs a few hundred bytes. Phase two gets
+        the bodies of the survivors, without their headers, and the two are
+        merged before caching. Worth it when most ids are unwanted, as with
+        the history api; a query that already filters should use
+        fetch_messages_batch.
+        """
+        pending = list(dict.fromkeys(message_ids))
+        results: dict[str, dict] = {}
+        if self.cache is not None:
+            results = self.cache.get_payloads(pending)
+            pending = [mid for mid in pending if mid not in results]
+            if self.cache_only:
+                self.lg.warning(f"{len(pending)} messages not in cache")
+                pending = []
+        metas, failed = self.execute_batch(
+            pending,
+            user_id,
+            batch_size,
+            format="metadata",
+            metadataHeaders=METADATA_HEADERS,
+            fields=METADATA_FIELDS,
         )
-        sender = next(
-            (header["value"] for header in headers if header["name"] == "From"),
-            "No Sender",
+        if failed:
+            raise FetchError(failed)
+        wanted = [mid for mid, meta in metas.items() if self.matches(meta)]
+        self.lg.info(f"{len(wanted)}/{len(metas)} new messages match on headers")
+        fetched, failed = self.execute_batch(
+            wanted, user_id, batch_size, fields=BODY_FIELDS
         )
+        for message_id, msg in fetched.items():
+            msg["payload"]["headers"] = metas[message_id]["payload"].get("headers", [])
+        if self.cache is not None and fetched:
+            self.cache.put_payloads(fetched)
+        if failed:
+            raise FetchError(failed)
+        results.update(fetched)
+        return {mid: msg for mid, msg in results.items() if self.matches(msg)}
+
+    def execute_batch(
+        self,
+        message_ids: list[str],
+        user_id="me",
+        batch_size: int = MAX_BATCH_SIZE,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        **params,
+    ) -> tuple[dict[str, dict], list[str]]:
+        """messages.get(**params) for each id over batch requests; no cache.
+
+        Returns the messages fetched and the ids that still failed after the
+        retries. Ids gmail answers 404 for (deleted since they were listed)
+        are in neither.
+        """
+        batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        pending = list(message_ids)
+        fetched: dict[str, dict] = {}
+        errors: dict[str, Exception] = {}
+        # building a resource walks the discovery document; do it once, not per id
+        messages = self.service.users().messages()
+        for attempt in range(max_retries + 1):
+            failed: dict[str, Exception] = {}
+            if attempt:
+                METRICS.inc("retries", len(pending), api="gmail", method="batch")
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    failed[request_id] = exception
+                else:
+                    fetched[request_id] = response
 
-        # Get the content of the email
-        payload = msg["payload"]
-        decoded_body = None
-        if "parts" in payload:
-            for part in payload["parts"]:
-                if part["mimeType"] == "text/plain":
-                    body = part["body"]["data"]
-                    decoded_body = base64.urlsafe_b64decode(body).decode("utf-8")
-                    raise NotImplementedError("Not implemented - email in text")
-                    break  # Stop after finding the first text/plain part
+            for i in range(0, len(pending), batch_size):
+                chunk = pending[i : i + batch_size]
+                batch = self.service.new_batch_http_request(callback=callback)
+                for message_id in chunk:
+                    request = messages.get(userId=user_id, id=message_id, **params)
+                    batch.add(request, request_id=message_id)
+                try:
+                    with METRICS.timer("stage", stage="gmail_fetch"):
+                        batch.execute()
+                except Exception as e:
+                    # the batch request itself failed (429, 5xx, transport);
+                    # its items are retried with the per-item failures
+                    if not is_retryable(e):
+                        raise e
+                    self.lg.warning(f"batch of {len(chunk)} failed; {e}")
+                    for message_id in chunk:
+                        if message_id not in fetched:
+                            failed[message_id] = e
+
+            pending = [mid for mid, e in failed.items() if is_retryable(e)]
+            errors.update((mid, e) for mid, e in failed.items() if mid not in pending)
+            if not pending:
+                break
+            if attempt < max_retries:
+                self.lg.warning(f"retrying {len(pending)} failed messages")
+                time.sleep(backoff * 2**attempt)
         else:
-            # If the email has no parts, assume it is plaintext
-            body = payload["body"]["data"]
-            decoded_body = base64.urlsafe_b64decode(body).decode("utf-8")
+            self.lg.error(f"giving up on {len(pending)} messages; {pending=}")
+            errors.update((mid, failed[mid]) for mid in pending)
+        dropped = []
+        for mid, e in errors.items():
+            if isinstance(e, HttpError) and e.resp.status == 404:
+                self.lg.warning(f"message gone, {mid=}")
+            else:
+                self.lg.error(f"fetch failed, {mid=}; {e}")
+                dropped.append(mid)
+        return fetched, dropped
+
+    def get_history_id(self, user_id="me") -> str:
+        request = self.service.users().getProfile(userId=user_id)
+        profile = request.execute(num_retries=NUM_RETRIES)
+        return profile["historyId"]
 
-        body = decoded_body if decoded_body is not None else "No Body"
+    def list_history_message_ids(
+        self, start_history_id: str, user_id="me"
+    ) -> tuple[list[str], str]:
+        """Ids of messages added since `start_history_id`, and the latest historyId
 
-        return EmailContent(sender=sender, subject=subject, body_text=body)
+        Raises HistoryExpiredError when the checkpoint is no longer available.
+        """
+        message_ids = []
+        page_token = None
+        while True:
+            try:
+                response = (
+                    self.service.users()
+                    .history()
+                    .list(
+                        userId=user_id,
+                        startHistoryId=start_history_id,
+                        historyTypes=["messageAdded"],
+                        maxResults=MAX_PAGE_SIZE,
+                        pageToken=page_token,
+                    )
+                    .execute(num_retries=NUM_RETRIES)
+                )
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(f"{start_history_id=} expired") from e
+                raise e
+            for history in response.get("history", []):
+                for added in history.get("messagesAdded", []):
+                    message_ids.append(added["message"]["id"])
+            page_token = response.get("nextPageToken")
+            if page_token is None:
+                return list(dict.fromkeys(message_ids)), response["historyId"]
+
+    def matches(self, msg: dict) -> bool:
+        """Whether a raw message (e.g. from the history api) is one we want"""
+        return True
+
+    def fetch_message(self, message_id, user_id="me") -> dict:
+        if self.cache is not None:
+            msg = self.cache.get_payload(message_id)
+            if msg is not None:
+                return msg
+            if self.cache_only:
+                raise KeyError(f"{message_id=} not in cache")
+        request = (
+            self.service.users()
+            .messages()
+            .get(userId=user_id, id=message_id, fields=FULL_FIELDS)
+        )
+        with METRICS.timer("stage", stage="gmail_fetch"):
+            msg = request.execute(num_retries=NUM_RETRIES)
+        if self.cache is not None:
+            self.cache.put_payloads({message_id: msg})
+        return msg
+
+    def get_attachment_data(
+        self, message_id: str, attachment_id: str, user_id="me"
+    ) -> str:
+        """base64url data of an attachment, as messages.get would inline it"""
+        request = (
+            self.service.users()
+            .messages()
+            .attachments()
+            .get(userId=user_id, messageId=message_id, id=attachment_id)
+        )
+        return request.execute(num_retries=NUM_RETRIES)["data"]
+
+    def load_attachment(self, ref: AttachmentRef, user_id="me") -> bytes:
+        """Download an attachment; only done when a parser asks for it"""
+        data = self.get_attachment_data(ref.message_id, ref.attachment_id, user_id)
+        return base64.urlsafe_b64decode(data)
+
+    def resolve_body(self, msg: dict, user_id="me") -> dict:
+        """Inline the body part if gmail left it behind an attachmentId.
+
+        Large html bodies come back that way. Runs before decode, which may be
+        in a pool worker without api access; other attachments stay as refs.
+        """
+        part = find_body_part(msg["payload"])
+        if part is None or "data" in part["body"] or self.cache_only:
+            return msg
+        attachment_id = part["body"].get("attachmentId")
+        if attachment_id is None:
+            return msg
+        part["body"]["data"] = self.get_attachment_data(
+            msg["id"], attachment_id, user_id
+        )
+        if self.cache is not None:
+            self.cache.put_payloads({msg["id"]: msg})
+        return msg
+
+    def get_message(self, message_id, user_id="me") -> EmailContent:
+        msg = self.fetch_message(message_id, user_id)
+        return self.parse_message(msg)
+
+    @staticmethod
+    def decode(msg: dict) -> EmailContent:
+        """CPU-bound half of parse_message; runs in pool workers, so no self"""
+        return decode_message(msg)
+
+    def load_parsed(self, msg: dict) -> Optional[EmailContent]:
+        """Previously parsed result for `msg`, if it can be reused"""
+        return None
+
+    def save_parsed(self, e: EmailContent) -> None:
+        pass
+
+    def decode_call(self, msg: dict) -> tuple:
+        """(function, *args) that decodes `msg`; picklable, for pool workers"""
+        return self.decode, msg
+
+    def parse_message(self, msg: dict) -> EmailContent:
+        e = self.load_parsed(msg)
+        if e is None:
+            func, *args = self.decode_call(self.resolve_body(msg))
+            with METRICS.timer("parse"):
+                e = func(*args)
+            self.save_parsed(e)
+        return e
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
     def run(self, before_date: Optional[str] = None, after_date: Optional[str] = None):
         # Get and print the messages in the user's inbox
@@ -121,69 +936,200 @@ class EmailClient:
         self.lg.info("logout successful")
 
 
-class OutpostEmailClient(EmailClient):
-    def __init__(self):
-        super().__init__()
-        self.kws = {
-            "Date & time": "datetime",
-            "Booking ref": "booking_ref",
-            "Membership No": "membership_no",
-            "Membership": "membership_name",
-            "Class": "class_name",
-            "Location": "location",
+class RegistryEmailClient(EmailClient):
+    """Every registered source in one mailbox pass.
+
+    One query ORs the parsers' sender/subject terms together, so adding a
+    source adds no extra listing or fetching. Each message goes to the
+    first parser that matches it, and results come back as one DataFrame
+    per parser.
+    """
+
+    def __init__(self, parsers: Optional[list[EmailParser]] = None, **kwargs):
+        kwargs.setdefault("batch_size", MAX_BATCH_SIZE)
+        super().__init__(**kwargs)
+        self.parsers = list(PARSERS.values()) if parsers is None else parsers
+
+    def parser_for(self, msg: dict) -> Optional[EmailParser]:
+        return next((p for p in self.parsers if p.matches(msg)), None)
+
+    def matches(self, msg: dict) -> bool:
+        return self.parser_for(msg) is not None
+
+    def build_registry_query(self, after_date: Optional[str] = None) -> str:
+        query = " OR ".join(parser.query() for parser in self.parsers)
+        if len(self.parsers) > 1:
+            query = f"({query})"
+        if after_date:
+            query = f"{query} after:{after_date}"
+        return query
+
+    def decode_call(self, msg: dict) -> tuple:
+        parser = self.parser_for(msg)
+        if parser is None:
+            # e.g. a reply the query let through; decoded, but with no record
+            return decode_message, msg
+        return decode_with_parser, msg, parser
+
+    def load_parsed(self, msg: dict) -> Optional[EmailContent]:
+        parser = self.parser_for(msg)
+        if self.cache is None or parser is None:
+            return None
+        record = self.cache.get_record(msg["id"], parser.name, parser.version)
+        if record is None:
+            return None
+        e = decode_message(msg)
+        e.record = parser.record_type(**record) if record else None
+        e.source = parser.name
+        return e
+
+    def save_parsed(self, e: EmailContent) -> None:
+        # this client's parsers, which need not be registered
+        parser = next((p for p in self.parsers if p.name == e.source), None)
+        if self.cache is None or parser is None:
+            return
+        record = e.record or {}
+        if dataclasses.is_dataclass(record):
+            record = dataclasses.asdict(record)
+        self.cache.put_record(e.message_id, parser.name, parser.version, record)
+
+    def iter_pages(self, after_date: Optional[str] = None) -> Iterator[list[dict]]:
+        if self.cache_only:
+            return self.iter_cached_pages(after_date=after_date)
+        return self.iter_raw_pages(self.build_registry_query(after_date))
+
+    def frame(self, parser: EmailParser, records: list) -> pd.DataFrame:
+        with METRICS.timer("stage", stage="consolidate"):
+            return parser.frame(records)
+
+    def frames(self, emails: list[EmailContent]) -> dict[str, pd.DataFrame]:
+        """One DataFrame per parser, including empty ones"""
+        records: dict[str, list] = {parser.name: [] for parser in self.parsers}
+        for e in emails:
+            if e.record and e.source in records:
+                records[e.source].append(e.record)
+        return {
+            parser.name: self.frame(parser, records[parser.name])
+            for parser in self.parsers
         }
 
-    def run(self, after_date: Optional[str] = None) -> pd.DataFrame:
-        # Get and print the messages in the user's inbox
-        self.get_messages(
-            sender_email="no-reply@outpostclimbing.rezeve.com",
-            after_date=after_date,
-            subject="Booking confirmed:",
-            limit=0,
+    def run(self, after_date: Optional[str] = None) -> dict[str, pd.DataFrame]:
+        self.emails = []
+        for msgs in self.iter_pages(after_date):
+            self.emails.extend(self.parse_messages(msgs))
+        return self.frames(self.emails)
+
+    def run_since(self, history_id: str) -> tuple[dict[str, pd.DataFrame], str]:
+        """Incremental run over messages added after `history_id`"""
+        self.emails = []
+        message_ids, new_history_id = self.list_history_message_ids(history_id)
+        if message_ids:
+            # history covers the whole mailbox; most ids are not for any parser
+            msgs = self.fetch_matching_batch(
+                message_ids, batch_size=self.batch_size or MAX_BATCH_SIZE
+            )
+            self.emails.extend(self.parse_messages(list(msgs.values())))
+        self.lg.info(f"{len(message_ids)} new messages since {history_id=}")
+        return self.frames(self.emails), new_history_id
+
+    def run_since_checkpoint(self, history_id: Optional[str]) -> tuple[Any, str]:
+        """run_since(history_id), or (None, current historyId) without one.
+
+        None also covers an expired checkpoint; the caller then falls back to
+        a date query. The historyId is read before that query lists anything,
+        so mail arriving mid-run is picked up by the next run.
+        """
+        if history_id is not None:
+            try:
+                return self.run_since(history_id)
+            except HistoryExpiredError as e:
+                self.lg.warning(f"{e}; falling back to date query")
+        return None, self.get_history_id()
+
+
+class OutpostEmailClient(RegistryEmailClient):
+    """RegistryEmailClient for OUTPOST_PARSER alone; results are one DataFrame"""
+
+    def __init__(
+        self,
+        service=None,
+        batch_size: int = MAX_BATCH_SIZE,
+        cache: Optional[MessageCache] = None,
+        cache_only: bool = False,
+        parse_workers: int = 0,
+        session=None,
+        gga: Optional[GoogleAuthManager] = None,
+    ):
+        super().__init__(
+            parsers=[OUTPOST_PARSER],
+            service=service,
+            batch_size=batch_size,
+            cache=cache,
+            cache_only=cache_only,
+            parse_workers=parse_workers,
+            session=session,
+            gga=gga,
         )
+        self.parser = OUTPOST_PARSER
+        self.kws = OUTPOST_KWS
+
+    def run(
+        self, after_date: Optional[str] = None, max_in_flight: int = 0
+    ) -> pd.DataFrame:
+        """All bookings after `after_date` as one DataFrame.
+
+        With `max_in_flight`, messages are fetched by AsyncEmailClient with up
+        to that many concurrent requests instead of batch requests.
+        """
+        # a long-lived client must not re-emit the previous run's rows
+        self.emails = []
+        try:
+            if max_in_flight and not self.cache_only:
+                try:
+                    from gmail_async import AsyncEmailClient
+                except ImportError:
+                    from ggrd.gmail_async import AsyncEmailClient
+
+                query = self.build_registry_query(after_date)
+                aec = AsyncEmailClient(self, max_in_flight=max_in_flight)
+                self.emails.extend(aec.run(query))
+            else:
+                # Parsing starts as soon as the first page is listed
+                for e in self.iter_bookings(after_date=after_date):
+                    self.emails.append(e)
+        except Exception as error:
+            self.lg.error(f"An error occurred after {len(self.emails)} emails: {error}")
+            raise error
         df = self.consolidate_all_emails()
         return df
 
+    def run_since(self, history_id: str) -> tuple[pd.DataFrame, str]:
+        frames, new_history_id = super().run_since(history_id)
+        return frames[self.parser.name], new_history_id
+
+    def iter_booking_pages(
+        self, after_date: Optional[str] = None
+    ) -> Iterator[list[dict]]:
+        """Raw booking messages a page at a time, for pipeline.Pipeline"""
+        return self.iter_pages(after_date)
+
+    def iter_bookings(self, after_date: Optional[str] = None) -> Iterator[EmailContent]:
+        if self.cache_only:
+            return self.iter_cached_messages(after_date=after_date)
+        return self.iter_messages(self.build_registry_query(after_date))
+
     def print_emails(self) -> None:
         for email in self.emails:
-            print(email.df)
-
-    def parse_html(self, html_str: str) -> pd.DataFrame:
-        dfs = [None]
-        with tempfile.NamedTemporaryFile(delete=True) as fp:
-            with open(fp.name, "w") as fwriter:
-                fwriter.write(html_str)
-            dfs = pd.read_html(fp)  # type: ignore
-        for df in dfs:
-            dff = df[df[0].isin(self.kws)]
-            if len(dff) < len(self.kws):
-                continue
-            else:
-                df = dff.copy()
-                df[0] = df[0].replace(self.kws)
-                df.set_index(0, inplace=True)
-                df = df.T
-                # Known bug: In the email on 2024-05-26,
-                # 	26 May 2024 @ 09:00 PM is parsed as 2024-05-26 09:00:00
-                df["datetime"] = pd.to_datetime(
-                    df["datetime"], format="%d %b %Y @ %H:%M %p", errors="raise"
-                )
-                return df
-        return pd.DataFrame()
+            print(email.record)
 
-    def get_message(self, message_id, user_id="me") -> EmailContent:
-        e = super().get_message(message_id, user_id)
-        df = self.parse_html(e.body_text)
-        return EmailContent(
-            sender=e.sender, subject=e.subject, body_text=e.body_text, df=df
-        )
+    def parse_html(self, html_str: str) -> Optional[BookingRecord]:
+        return parse_outpost_html(html_str, self.kws)
+
+    def to_frame(self, records: list[BookingRecord]) -> pd.DataFrame:
+        return self.frame(self.parser, records)
 
     def consolidate_all_emails(self) -> pd.DataFrame:
-        df = pd.concat([email.df for email in self.emails])
-        df.sort_values(by="datetime", inplace=True, ascending=True)
-        df.reset_index(drop=True, inplace=True)
-        df = df[self.kws.values()]
-        return df
+        return self.to_frame([email.record for email in self.emails if email.record])
 
 
 def main():
@@ -192,5 +1138,6 @@ def main():
     df = op.run(after_date="2023-12-01")
     print(df)
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+
+try:
+    from gmail import (
+        FULL_FIELDS,
+        MAX_PAGE_SIZE,
+        EmailClient,
+        EmailContent,
+        FetchError,
+        is_retryable_status,
+    )
+    from metrics import METRICS
+    from utils import CustomLogger
+except ImportError:
+    from ggrd.gmail import (
+        FULL_FIELDS,
+        MAX_PAGE_SIZE,
+        EmailClient,
+        EmailContent,
+        FetchError,
+        is_retryable_status,
+    )
+    from ggrd.metrics import METRICS
+    from ggrd.utils import CustomLogger
+
+APP_NAME = "ggrd"
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1"
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS_PER_SECOND = 250  # per user
+QUOTA_UNITS = {"messages.get": 5, "messages.list": 5, "history.list": 2}
+REQUEST_TIMEOUT = 60  # seconds
+
+
+class TokenBucket:
+    """Async rate limiter; `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Retry-After as seconds; the header may be a delay or an http date"""
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_found(error) -> bool:
+    return (
+        isinstance(error, requests.HTTPError)
+        and error.response is not None
+        and error.response.status_code == 404
+    )
+
+
+class AsyncEmailClient:
+    """Concurrent messages.get for an EmailClient.
+
+    Requests go out over the auth manager's pooled keep-alive session. The number in flight
+    is capped, and a token bucket keeps the rate under the per-user quota.
+    Retryable failures (429, 5xx, rate-limit 403s, dropped connections and
+    timeouts) back off exponentially, honouring Retry-After. Parsing, caching
+    and `matches` stay with the wrapped client.
+    """
+
+    def __init__(
+        self,
+        client: EmailClient,
+        max_in_flight: int = 20,
+        quota_units_per_second: float = QUOTA_UNITS_PER_SECOND,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        session=None,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self.lg = CustomLogger(name=APP_NAME).getLogger()
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.quota_units_per_second = quota_units_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        if session is None:
+            session = client.session
+        if session is None:
+            session = client.gga.get_authorized_session(pool_size=max_in_flight)
+        self.session = session
+        self.n_requests = 0
+        self.n_retries = 0
+
+    async def request(self, method_name: str, path: str, params: dict) -> dict:
+        """One api call, retried on quota and server errors"""
+        loop = asyncio.get_running_loop()
+        url = f"{GMAIL_API_URL}/{path}"
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire(QUOTA_UNITS.get(method_name, 1))
+            try:
+                async with self.in_flight:
+                    response = await loop.run_in_executor(
+                        self.executor,
+                        lambda: self.session.request(
+                            "GET", url, params=params, timeout=self.timeout
+                        ),
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # as transient as a 503, but there are no headers to go by
+                if attempt == self.max_retries:
+                    raise e
+                status = type(e).__name__
+                delay = self.backoff * 2**attempt + random.uniform(0, self.backoff)
+            else:
+                self.n_requests += 1
+                if response.status_code == 200:
+                    return response.json()
+                retryable = is_retryable_status(response.status_code, response.content)
+                if not retryable or attempt == self.max_retries:
+                    break
+                status = response.status_code
+                delay = retry_after_seconds(response.headers)
+                if delay is None:
+                    delay = self.backoff * 2**attempt + random.uniform(0, self.backoff)
+            self.n_retries += 1
+            METRICS.inc("retries", api="gmail", method=method_name)
+            self.lg.warning(f"{method_name} {status}; retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        response.raise_for_status()
+        raise RuntimeError(f"{method_name} failed; {response.status_code=}")
+
+    async def list_message_ids(
+        self, query: str, user_id="me", limit: int = 0
+    ) -> list[str]:
+        message_ids: list[str] = []
+        params = {"q": query, "maxResults": MAX_PAGE_SIZE}
+        while True:
+            response = await self.request(
+                "messages.list", f"users/{user_id}/messages", params
+            )
+            message_ids.extend(m["id"] for m in response.get("messages", []))
+            if limit and len(message_ids) >= limit:
+                return message_ids[:limit]
+            if "nextPageToken" not in response:
+                return message_ids
+            params["pageToken"] = response["nextPageToken"]
+
+    async def fetch_message(self, message_id: str, user_id="me") -> dict:
+        return await self.request(
+            "messages.get",
+            f"users/{user_id}/messages/{message_id}",
+            {"fields": FULL_FIELDS},
+        )
+
+    async def fetch_messages(self, message_ids: list[str], user_id="me") -> list[dict]:
+        """Payloads for `message_ids`, from the cache or fetched concurrently.
+
+        Like EmailClient.fetch_messages_batch, raises FetchError for ids that
+        still fail after their retries, once the rest are cached; ids gmail
+        answers 404 for (deleted since they were listed) are skipped.
+        """
+        cache = self.client.cache
+        cached = cache.get_payloads(message_ids) if cache is not None else {}
+        missing = [mid for mid in message_ids if mid not in cached]
+        results = await asyncio.gather(
+            *(self.fetch_message(mid, user_id) for mid in missing),
+            return_exceptions=True,
+        )
+        fetched, failed = {}, []
+        for message_id, result in zip(missing, results):
+            if is_not_found(result):
+                self.lg.warning(f"message gone, {message_id=}")
+            elif isinstance(result, Exception):
+                self.lg.error(f"fetch failed, {message_id=}; {result}")
+                failed.append(message_id)
+            else:
+                fetched[message_id] = result
+        if cache is not None and fetched:
+            cache.put_payloads(fetched)
+        if failed:
+            raise FetchError(failed)
+        msgs = cached | fetched
+        return [msgs[mid] for mid in message_ids if mid in msgs]
+
+    async def get_messages(
+        self, query: str = "", user_id="me", limit: int = 0
+    ) -> list[EmailContent]:
+        # created here so they bind to the running loop
+        self.bucket = TokenBucket(self.quota_units_per_second)
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        with ThreadPoolExecutor(self.max_in_flight) as self.executor:
+            message_ids = await self.list_message_ids(query, user_id, limit)
+            msgs = await self.fetch_messages(message_ids, user_id)
+        self.lg.info(
+            f"fetched {len(msgs)}/{len(message_ids)} messages; "
+            f"{self.n_requests} requests, {self.n_retries} retries"
+        )
+        return list(self.client.parse_messages(msgs))
+
+    def run(self, query: str = "", user_id="me", limit: int = 0) -> list[EmailContent]:
+        return asyncio.run(self.get_messages(query, user_id, limit))
@@ -0,0 +1,98 @@
+from typing import Optional
+
+try:
+    from cache import MessageCache
+    from gmail import BOOKING_LEAD_TIME, RegistryEmailClient
+    from sheets import GoogleSheetClient
+    from store import BookingStore
+    from utils import CustomLogger, JsonStateFile, get_state_dirpath
+except ImportError:
+    from ggrd.cache import MessageCache
+    from ggrd.gmail import BOOKING_LEAD_TIME, RegistryEmailClient
+    from ggrd.sheets import GoogleSheetClient
+    from ggrd.store import BookingStore
+    from ggrd.utils import CustomLogger, JsonStateFile, get_state_dirpath
+
+APP_NAME = "ggrd"
+
+
+class MailboxSync:
+    """Outpost.pull_updates_from_email for every registered parser at once.
+
+    One mailbox pass (or one history read) feeds each parser's worksheet,
+    and its BookingStore if one is given in `stores`. Outpost is the
+    single-parser case: OutpostEmailClient is a RegistryEmailClient, and
+    both pick incremental or date runs with run_since_checkpoint.
+    """
+
+    def __init__(
+        self,
+        email: Optional[RegistryEmailClient] = None,
+        gsc: Optional[GoogleSheetClient] = None,
+        stores: Optional[dict[str, BookingStore]] = None,
+        parse_workers: int = 0,
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        if email is None:
+            email = RegistryEmailClient(
+                cache=MessageCache(), parse_workers=parse_workers
+            )
+        self.email = email
+        self.spreadsheet_name = f"{APP_NAME}-Mailbox-Records"
+        if gsc is None:
+            gsc = GoogleSheetClient(spreadsheet_name=self.spreadsheet_name)
+        self.gsc = gsc
+        self.stores = stores or {}
+        self.checkpoint = JsonStateFile(
+            get_state_dirpath() / f"{self.spreadsheet_name}-checkpoint.json"
+        )
+
+    def last_after_date(self) -> Optional[str]:
+        """Earliest of the sheets' latest entries, less BOOKING_LEAD_TIME.
+
+        None if any sheet is empty.
+        """
+        latest = []
+        for parser in self.email.parsers:
+            try:
+                latest.append(
+                    self.gsc.get_last_entry_datetime(
+                        sheet_name=parser.sheet_name, key=parser.key
+                    )
+                )
+            except RuntimeError:
+                return None
+        if not latest:
+            return None
+        return (min(latest) - BOOKING_LEAD_TIME).strftime("%Y/%m/%d")
+
+    def pull(self, incremental: bool = True) -> dict[str, int]:
+        """Append new records to each parser's sheet; returns rows inserted"""
+        history_id = None
+        if incremental:
+            history_id = self.checkpoint.load().get("history_id")
+        frames, history_id = self.email.run_since_checkpoint(history_id)
+        if frames is None:
+            frames = self.email.run(after_date=self.last_after_date())
+        parsers = {parser.name: parser for parser in self.email.parsers}
+        inserted = {}
+        for name, df in frames.items():
+            parser = parsers[name]
+            if df.empty:
+                inserted[name] = 0
+                continue
+            result = self.gsc.update_data(df, parser.sheet_name, key=parser.key)
+            inserted[name] = result.inserted
+            if name in self.stores:
+                self.stores[name].append(df)
+        self.checkpoint.save({"history_id": history_id})
+        self.lg.info(f"pulled {inserted=}")
+        return inserted
+
+
+def main():
+    MailboxSync().pull()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import base64
+import email
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from email.header import decode_header, make_header
+from email.message import Message
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+
+try:
+    from gmail import OUTPOST_PARSER, EmailParser, decode_with_parser
+    from utils import CustomLogger
+except ImportError:
+    from ggrd.gmail import OUTPOST_PARSER, EmailParser, decode_with_parser
+    from ggrd.utils import CustomLogger
+
+APP_NAME = "ggrd"
+RANGE_BYTES = 64 * 1024 * 1024  # work unit for the process pool
+BOUNDARY = b"\nFrom "  # as in the stdlib mailbox module: "From " at line start
+
+
+def first_boundary(mm: mmap.mmap, start: int) -> int:
+    """Offset of the first message starting at or after `start`; -1 if none"""
+    if start == 0 and mm[:5] == b"From ":
+        return 0
+    i = mm.find(BOUNDARY, max(start - 1, 0))
+    return -1 if i == -1 else i + 1
+
+
+def header_end(mm: mmap.mmap, start: int, end: int) -> int:
+    """Offset of the blank line that ends the headers starting at `start`"""
+    ends = [
+        i
+        for i in (mm.find(b"\n\n", start, end), mm.find(b"\r\n\r\n", start, end))
+        if i != -1
+    ]
+    return min(ends) if ends else end
+
+
+def envelope_message_id(envelope: bytes, offset: int) -> str:
+    # takeout writes "From <X-GM-MSGID>@xxx <date>"; gmail ids are its hex
+    token = envelope[5:].split(b"@", 1)[0]
+    return f"{int(token):x}" if token.isdigit() else f"mbox-{offset}"
+
+
+def header_value(value: str) -> str:
+    """Unfolded header text, with any =?charset?...?= words decoded"""
+    value = re.sub(r"\r?\n(?=[ \t])", "", str(value))
+    if "=?" in value:
+        value = str(make_header(decode_header(value)))
+    return value
+
+
+def gmail_headers(message: Message) -> list[dict]:
+    return [{"name": k, "value": header_value(v)} for k, v in message.items()]
+
+
+def message_payload(part: Message) -> dict:
+    """A MIME part in the shape of a messages.get (format=full) payload"""
+    payload = {
+        "mimeType": part.get_content_type(),
+        "filename": part.get_filename() or "",
+        "headers": gmail_headers(part),
+        "body": {},
+    }
+    if part.is_multipart():
+        payload["parts"] = [message_payload(child) for child in part.get_payload()]
+    else:
+        data = part.get_payload(decode=True) or b""
+        payload["body"] = {
+            "size": len(data),
+            "data": base64.urlsafe_b64encode(data).decode(),
+        }
+    return payload
+
+
+def gmail_message(message_id: str, message: Message) -> dict:
+    """A parsed email as the gmail api would return it, for EmailParser"""
+    try:
+        internal_date = int(parsedate_to_datetime(message["Date"]).timestamp() * 1000)
+    except (TypeError, ValueError):
+        internal_date = 0
+    return {
+        "id": message_id,
+        "internalDate": str(internal_date),
+        "payload": message_payload(message),
+    }
+
+
+def scan_range(
+    filepath: Path, start: int, end: int, parsers: list[EmailParser]
+) -> list[tuple[str, str, object]]:
+    """(parser name, message id, record) for messages starting in [start, end).
+
+    Runs in pool workers, each with its own mapping of the file. Only the
+    header block of a message is read until one of `parsers` matches it;
+    then the whole message is parsed, the same way as one from gmail.
+    """
+    # compat32 throughout: policy.default builds an object per header, which
+    # costs more than the rest of the scan put together
+    header_parser = BytesHeaderParser()
+    senders = [parser.sender_email.encode() for parser in parsers]
+    results = []
+    with open(filepath, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return results
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = first_boundary(mm, start)
+            while pos != -1 and pos < end:
+                next_pos = first_boundary(mm, pos + 1)
+                msg_end = len(mm) if next_pos == -1 else next_pos
+                envelope_end = mm.find(b"\n", pos, msg_end)
+                if envelope_end == -1:
+                    break  # a truncated last message
+                body_start = header_end(mm, envelope_end, msg_end)
+                headers = mm[envelope_end + 1 : body_start]
+                # a cheap byte search rules out nearly everything else
+                if any(sender in headers for sender in senders):
+                    meta = {
+                        "payload": {
+                            "headers": gmail_headers(header_parser.parsebytes(headers))
+                        }
+                    }
+                    parser = next((p for p in parsers if p.matches(meta)), None)
+                    if parser is not None:
+                        message_id = envelope_message_id(mm[pos:envelope_end], pos)
+                        message = email.message_from_bytes(
+                            mm[envelope_end + 1 : msg_end]
+                        )
+                        e = decode_with_parser(
+                            gmail_message(message_id, message), parser
+                        )
+                        results.append((parser.name, message_id, e.record))
+                pos = next_pos
+    return results
+
+
+class MboxSource:
+    """Bookings from a local mbox file, e.g. a Google Takeout export.
+
+    The file is memory-mapped and cut into byte ranges that a process pool
+    scans in parallel (see scan_range). Matching messages go through the
+    same EmailParser as the gmail path, and no api quota is used.
+    """
+
+    def __init__(
+        self,
+        filepath: Path,
+        parsers: Optional[list[EmailParser]] = None,
+        workers: int = 0,
+        range_bytes: int = RANGE_BYTES,
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        self.filepath = Path(filepath)
+        self.parsers = [OUTPOST_PARSER] if parsers is None else parsers
+        self.workers = workers or os.cpu_count() or 1
+        self.range_bytes = range_bytes
+
+    def ranges(self) -> list[tuple[int, int]]:
+        size = self.filepath.stat().st_size
+        # at least a few ranges per worker, so one slow range can't hold up the rest
+        range_bytes = min(self.range_bytes, max(size // (self.workers * 4), 1))
+        return [(i, min(i + range_bytes, size)) for i in range(0, size, range_bytes)]
+
+    def iter_results(self) -> Iterator[tuple[str, str, object]]:
+        ranges = self.ranges()
+        args = [(self.filepath, start, end, self.parsers) for start, end in ranges]
+        if self.workers == 1 or len(ranges) <= 1:
+            for arg in args:
+                yield from scan_range(*arg)
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            for results in executor.map(scan_range, *zip(*args)):
+                yield from results
+
+    def frames(self) -> dict[str, pd.DataFrame]:
+        """One DataFrame per parser, oldest first, like RegistryEmailClient"""
+        records: dict[str, list] = {parser.name: [] for parser in self.parsers}
+        n_matched = 0
+        for name, _, record in self.iter_results():
+            n_matched += 1
+            if record:
+                records[name].append(record)
+        frames = {
+            parser.name: parser.frame(records[parser.name]) for parser in self.parsers
+        }
+        self.lg.info(
+            f"[mbox]: {n_matched} matching messages in {self.filepath.name},"
+            f" {sum(len(df) for df in frames.values())} records"
+        )
+        return frames
+
+
+def main():
+    import sys
+
+    for name, df in MboxSource(Path(sys.argv[1])).frames().items():
+        print(name, df.shape)
+
+
+if __name__ == "__main__":
+    main()
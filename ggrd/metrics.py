@@ -0,0 +1,174 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+APP_NAME = "ggrd"
+# seconds; wide enough for a parse (ms) and a whole pull (minutes)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0)
+
+
+def metric_key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+def format_key(key: tuple, extra: tuple = ()) -> str:
+    """name{label="value",...}, as in the prometheus text format"""
+    name, labels = key
+    labels = labels + extra
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        total, result = 0, []
+        for bound, n in zip(bounds, self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": round(self.min, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+        }
+
+
+class Metrics:
+    """Process-wide counters and histograms for one run.
+
+    Stages call inc/observe/timer; the cli writes the result as a json run
+    report and a prometheus textfile (for node_exporter's textfile
+    collector). Thread-safe; parse pool workers report through their
+    parent (see gmail.timed_call).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started = time.time()
+            self.counters: dict[tuple, float] = {}
+            self.histograms: dict[tuple, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe the duration of the block in `{name}_seconds`"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - t0, **labels)
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(
+                    timespec="seconds"
+                ),
+                "duration_seconds": round(time.time() - self.started, 3),
+                "counters": {
+                    format_key(k): v for k, v in sorted(self.counters.items())
+                },
+                "histograms": {
+                    format_key(k): h.summary()
+                    for k, h in sorted(self.histograms.items())
+                },
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            types_seen = set()
+            for key, value in sorted(self.counters.items()):
+                name = f"{APP_NAME}_{key[0]}_total"
+                if name not in types_seen:
+                    types_seen.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{format_key((name, key[1]))} {value}")
+            for key, histogram in sorted(self.histograms.items()):
+                name = f"{APP_NAME}_{key[0]}"
+                if name not in types_seen:
+                    types_seen.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, n in histogram.cumulative():
+                    bucket_key = (f"{name}_bucket", key[1])
+                    lines.append(f"{format_key(bucket_key, (('le', bound),))} {n}")
+                lines.append(f"{format_key((f'{name}_sum', key[1]))} {histogram.sum}")
+                lines.append(
+                    f"{format_key((f'{name}_count', key[1]))} {histogram.count}"
+                )
+            name = f"{APP_NAME}_last_run_timestamp_seconds"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, dirpath: Path) -> tuple[Path, Path]:
+        """ggrd-run.json and ggrd.prom in `dirpath`, replaced atomically"""
+        dirpath = Path(dirpath)
+        dirpath.mkdir(parents=True, exist_ok=True)
+        json_filepath = dirpath / f"{APP_NAME}-run.json"
+        prom_filepath = dirpath / f"{APP_NAME}.prom"
+        for filepath, text in [
+            (json_filepath, json.dumps(self.report(), indent=2)),
+            (prom_filepath, self.to_prometheus()),
+        ]:
+            # the textfile collector may read at any moment; never a partial file
+            tmp_filepath = filepath.with_suffix(".tmp")
+            tmp_filepath.write_text(text)
+            tmp_filepath.replace(filepath)
+        return json_filepath, prom_filepath
+
+
+METRICS = Metrics()
+
+
+def main():
+    with METRICS.timer("stage", stage="example"):
+        METRICS.inc("api_requests", api="gmail.googleapis.com")
+    print(json.dumps(METRICS.report(), indent=2))
+    print(METRICS.to_prometheus())
+
+
+if __name__ == "__main__":
+    main()
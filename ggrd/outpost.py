@@ -1,37 +1,253 @@
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
 try:
-    from gmail import OutpostEmailClient
-    from sheets import GoogleSheetClient
-    from utils import CustomLogger
+    from auth import GoogleAuthManager
+    from metrics import METRICS
+    from utils import CustomLogger, JsonStateFile, get_state_dirpath
 except ImportError:
+    from ggrd.auth import GoogleAuthManager
+    from ggrd.metrics import METRICS
+    from ggrd.utils import CustomLogger, JsonStateFile, get_state_dirpath
+
+# gmail, sheets, pipeline and store load pandas and gspread; they are
+# imported on first use, so has_updates() runs without them
+if TYPE_CHECKING:
     from ggrd.gmail import OutpostEmailClient
     from ggrd.sheets import GoogleSheetClient
-    from ggrd.utils import CustomLogger
+    from ggrd.store import BookingStore
 
 APP_NAME = "ggrd"
 
 
 class Outpost:
-    def __init__(self):
+    def __init__(
+        self,
+        parse_workers: int = 0,
+        email: Optional["OutpostEmailClient"] = None,
+        gsc: Optional["GoogleSheetClient"] = None,
+        store: Optional["BookingStore"] = None,
+        gga: Optional[GoogleAuthManager] = None,
+        spreadsheet_name: Optional[str] = None,
+        account: Optional[str] = None,
+    ):
+        """`gga` and `spreadsheet_name` select another account and sheet.
+
+        `account` names the mailbox behind `gga`. The checkpoint and message
+        cache are kept per account, since a historyId means nothing to
+        another mailbox and two accounts may use the same sheet title.
+        Clients not given are built on first use.
+        """
         self.lg = CustomLogger(APP_NAME).getLogger()
-        self.email = OutpostEmailClient()
-        self.gsc = GoogleSheetClient(
-            spreadsheet_name=f"{APP_NAME}-Outpost-ClimbRecords"
+        self.parse_workers = parse_workers
+        self.account = account
+        self.cache_filepath = None
+        if account is not None:
+            self.cache_filepath = get_state_dirpath() / f"{account}-messages.sqlite3"
+        elif spreadsheet_name is not None:
+            self.cache_filepath = (
+                get_state_dirpath() / f"{spreadsheet_name}-messages.sqlite3"
+            )
+        if spreadsheet_name is None:
+            spreadsheet_name = f"{APP_NAME}-Outpost-ClimbRecords"
+        self.spreadsheet_name = spreadsheet_name
+        if gga is not None:
+            self.gga = gga
+        if email is not None:
+            self.email = email
+        if gsc is not None:
+            self.gsc = gsc
+        # local copy of every booking written to the sheet, if given
+        self.store = store
+        state_name = self.spreadsheet_name
+        if account is not None:
+            state_name = f"{account}-{state_name}"
+        self.checkpoint = JsonStateFile(
+            get_state_dirpath() / f"{state_name}-checkpoint.json"
+        )
+
+    @cached_property
+    def gga(self) -> GoogleAuthManager:
+        return GoogleAuthManager()
+
+    @cached_property
+    def email(self) -> "OutpostEmailClient":
+        try:
+            from cache import MessageCache
+            from gmail import OutpostEmailClient
+        except ImportError:
+            from ggrd.cache import MessageCache
+            from ggrd.gmail import OutpostEmailClient
+        return OutpostEmailClient(
+            cache=MessageCache(self.cache_filepath),
+            parse_workers=self.parse_workers,
+            gga=self.gga,
         )
 
-    def pull_updates_from_email(self, self_reset: bool = True) -> None:
+    @cached_property
+    def gsc(self) -> "GoogleSheetClient":
+        try:
+            from sheets import GoogleSheetClient
+        except ImportError:
+            from ggrd.sheets import GoogleSheetClient
+        return GoogleSheetClient(spreadsheet_name=self.spreadsheet_name, gga=self.gga)
+
+    def has_updates(self) -> bool:
+        """Whether any mail arrived since the last pull.
+
+        One history.list call from the saved historyId, with no pandas,
+        gspread or googleapiclient loaded. Reads, labels and archiving don't
+        count; new mail that isn't a booking does, so False is certain and
+        True only means "maybe".
+        """
+        history_id = self.checkpoint.load().get("history_id")
+        if history_id is None:
+            return True
+        return self.gga.has_messages_added(str(history_id))
+
+    def stream_bookings(
+        self, after_date: Optional[str] = None, reset: bool = False
+    ) -> int:
+        """Fetch, parse and upsert bookings through a bounded Pipeline.
+
+        Memory stays flat however many emails match; use it for full rebuilds
+        and long catch-ups. With `reset`, the rebuilt sheet is swapped in only
+        once the whole run succeeds.
+        """
         try:
-            dt = self.gsc.get_last_entry_datetime()
-            df = self.email.run(after_date=dt.strftime("%Y/%m/%d"))
-            self.gsc.update_data(df)
-        except Exception as e:
-            self.lg.error(f"{e=}")
-            if self_reset:
+            from pipeline import MultiSink, Pipeline, SheetSink, StoreSink
+        except ImportError:
+            from ggrd.pipeline import MultiSink, Pipeline, SheetSink, StoreSink
+        sheet_sink = SheetSink(self.gsc, list(self.email.kws.values()), reset=reset)
+        sink = sheet_sink
+        if self.store is not None:
+            sink = MultiSink(sheet_sink, StoreSink(self.store))
+        pages = self.email.iter_booking_pages(after_date=after_date)
+        Pipeline(self.email, sink).run(pages)
+        sheet_sink.commit()
+        return sheet_sink.inserted
+
+    def backfill_from_mbox(
+        self, filepath: Path, reset: bool = False, workers: int = 0
+    ) -> int:
+        """Upsert the bookings in a local mbox export (e.g. Google Takeout).
+
+        Reads the file with MboxSource, so no gmail quota is used. With
+        `reset`, the sheet is replaced through reset_and_write_data's staging
+        swap. The history checkpoint is left alone; the next pull carries on
+        from there.
+        """
+        try:
+            from gmail import OUTPOST_PARSER
+            from mbox import MboxSource
+        except ImportError:
+            from ggrd.gmail import OUTPOST_PARSER
+            from ggrd.mbox import MboxSource
+        source = MboxSource(filepath, parsers=[OUTPOST_PARSER], workers=workers)
+        df = source.frames()[OUTPOST_PARSER.name]
+        if reset:
+            self.gsc.reset_and_write_data(df)
+            written = len(df)
+        elif df.empty:
+            written = 0
+        else:
+            written = self.gsc.update_data(df).inserted
+        if self.store is not None and not df.empty:
+            self.store.append(df)
+        return written
+
+    def pull_updates_from_email(
+        self, self_reset: bool = True, incremental: bool = True, stream: bool = False
+    ) -> int:
+        """Append new bookings to the sheet; returns how many were added.
+
+        Errors trigger a full reset_data, or are raised without `self_reset`.
+        A FetchError is always raised, with the checkpoint left where it was.
+        """
+        try:
+            from gmail import BOOKING_LEAD_TIME, FetchError
+        except ImportError:
+            from ggrd.gmail import BOOKING_LEAD_TIME, FetchError
+        inserted = 0
+        with METRICS.timer("stage", stage="pull"):
+            try:
+                history_id = None
+                if incremental:
+                    history_id = self.checkpoint.load().get("history_id")
+                df, history_id = self.email.run_since_checkpoint(history_id)
+                if df is None:
+                    # the sheet's latest class was booked some time before it;
+                    # update_data skips the bookings already in the sheet
+                    latest = self.gsc.get_last_entry_datetime()
+                    after_date = (latest - BOOKING_LEAD_TIME).strftime("%Y/%m/%d")
+                    if stream:
+                        inserted = self.stream_bookings(after_date=after_date)
+                    else:
+                        df = self.email.run(after_date=after_date)
+                if df is not None and not df.empty:
+                    inserted = self.gsc.update_data(df).inserted
+                    if self.store is not None:
+                        self.store.append(df)
+                self.checkpoint.save({"history_id": history_id})
+            except FetchError as e:
+                # the checkpoint stays put, so the next pull asks for them again;
+                # a full reset would only refetch everything else as well
+                self.lg.error(f"{e}; checkpoint not advanced, {e.message_ids=}")
+                METRICS.inc("pull_errors")
+                raise e
+            except Exception as e:
+                self.lg.error(f"{e=}")
+                METRICS.inc("pull_errors")
+                if not self_reset:
+                    raise e
                 self.lg.warning("attempting self reset...")
-                self.reset_data()
+                self.reset_data(stream=stream)
+        METRICS.inc("bookings_inserted", inserted)
+        return inserted
+
+    def reset_data(self, cache_only: bool = False, stream: bool = False) -> int:
+        """Rebuild the sheet; with `cache_only`, from cached messages alone.
+
+        Returns the number of bookings written.
+        """
+        self.email.cache_only = cache_only
+        try:
+            history_id = None if cache_only else self.email.get_history_id()
+            if stream:
+                written = self.stream_bookings(reset=True)
+            else:
+                df = self.email.run()
+        finally:
+            self.email.cache_only = False
+        if not stream:
+            self.gsc.reset_and_write_data(df)
+            if self.store is not None:
+                self.store.append(df)
+            written = len(df)
+        if history_id is not None:
+            self.checkpoint.save({"history_id": history_id})
+        return written
+
+    def is_new(self) -> bool:
+        """No checkpoint and no rows in the sheet: a pull has nothing to go on.
+
+        pull_updates_from_email needs one or the other, so a new account
+        starts with reset_data instead.
+        """
+        if self.checkpoint.load().get("history_id") is not None:
+            return False
+        try:
+            self.gsc.get_last_entry_datetime()
+        except RuntimeError:
+            return True
+        return False
 
-    def reset_data(self) -> None:
-        df = self.email.run()
-        self.gsc.reset_and_write_data(df)
+    def rebuild_sheet_from_store(self) -> None:
+        """Regenerate the sheet from the local store, without touching gmail"""
+        if self.store is None:
+            raise ValueError("no BookingStore configured")
+        self.gsc.reset_and_write_data(self.store.read())
 
 
 def main():
@@ -0,0 +1,229 @@
+import csv
+import queue
+import threading
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+try:
+    from gmail import EmailClient
+    from sheets import GoogleSheetClient
+    from store import BookingStore
+    from utils import DATETIME_FMT, CustomLogger
+except ImportError:
+    from ggrd.gmail import EmailClient
+    from ggrd.sheets import GoogleSheetClient
+    from ggrd.store import BookingStore
+    from ggrd.utils import DATETIME_FMT, CustomLogger
+
+APP_NAME = "ggrd"
+_DONE = object()
+
+
+class Sink:
+    """Destination for parsed records, written a DataFrame chunk at a time"""
+
+    def write(self, df: pd.DataFrame) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class CsvSink(Sink):
+    """Appends records to a csv file, writing the header if the file is new"""
+
+    def __init__(self, filepath: Path, columns: list[str]):
+        self.columns = columns
+        is_new = not filepath.is_file() or filepath.stat().st_size == 0
+        self.fp = open(filepath, "a", newline="")
+        if is_new:
+            csv.writer(self.fp).writerow(columns)
+
+    def write(self, df: pd.DataFrame) -> None:
+        df.to_csv(
+            self.fp,
+            columns=self.columns,
+            header=False,
+            index=False,
+            date_format=DATETIME_FMT,
+        )
+        self.fp.flush()
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class SheetSink(Sink):
+    """Upserts each chunk with GoogleSheetClient.update_data.
+
+    Rows are sorted within a chunk, but chunks arrive newest page first, so a
+    streamed sheet is not in overall date order. With `reset`, chunks go to a
+    staging worksheet instead, and commit() sorts it and swaps it in for
+    `sheet_name` once every chunk is written; until then readers keep seeing
+    the old rows.
+    """
+
+    def __init__(
+        self,
+        gsc: GoogleSheetClient,
+        columns: list[str],
+        sheet_name: str = "data",
+        reset: bool = False,
+    ):
+        self.gsc = gsc
+        self.columns = columns
+        self.sheet_name = sheet_name
+        self.inserted = 0
+        self.staging = None
+        if reset:
+            self.staging = gsc.create_staging_worksheet(sheet_name, 1, len(columns))
+            gsc.clear_data(columns, self.staging.title)
+
+    def write(self, df: pd.DataFrame) -> None:
+        df = df.sort_values(by="datetime")
+        sheet_name = self.sheet_name if self.staging is None else self.staging.title
+        self.inserted += self.gsc.update_data(df, sheet_name).inserted
+
+    def commit(self) -> None:
+        """Swap in the staging worksheet, after a run that didn't fail.
+
+        Not part of close(), which Pipeline.run also calls on errors: a
+        failed reset must leave the old sheet in place.
+        """
+        if self.staging is not None:
+            # oldest first, as reset_and_write_data leaves it
+            self.gsc.sort_by_datetime(self.staging)
+            self.gsc.commit_staging(self.staging, self.sheet_name)
+            self.staging = None
+
+
+class StoreSink(Sink):
+    def __init__(self, store: BookingStore):
+        self.store = store
+        self.inserted = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        self.inserted += self.store.append(df).inserted
+
+
+class MultiSink(Sink):
+    """Writes every chunk to each of `sinks` in turn"""
+
+    def __init__(self, *sinks: Sink):
+        self.sinks = sinks
+
+    def write(self, df: pd.DataFrame) -> None:
+        for sink in self.sinks:
+            sink.write(df)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+class Pipeline:
+    """fetch -> parse -> sink, connected by bounded queues.
+
+    One thread fetches pages of raw messages and one parses them; the calling
+    thread turns every `chunk_size` records into a DataFrame with
+    `email.to_frame` and writes it to the sink. A full queue
+    blocks the stage feeding it, so at most `queue_size` pages and a chunk of
+    records are held at once. Email bodies are dropped as soon as a page is
+    parsed; only the records travel on.
+    """
+
+    def __init__(
+        self, email: EmailClient, sink: Sink, queue_size: int = 2, chunk_size: int = 500
+    ):
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        self.email = email
+        self.sink = sink
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.stop = threading.Event()
+        self.errors: list[Exception] = []
+
+    def put(self, q: queue.Queue, item) -> None:
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, q: queue.Queue):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return _DONE
+
+    def fail(self, e: Exception) -> None:
+        self.lg.error(f"pipeline stopped; {e=}")
+        self.errors.append(e)
+        self.stop.set()
+
+    def fetch(self, pages: Iterable[list[dict]], out: queue.Queue) -> None:
+        try:
+            for msgs in pages:
+                if self.stop.is_set():
+                    break
+                self.put(out, msgs)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(out, _DONE)
+
+    def parse(self, inp: queue.Queue, out: queue.Queue) -> None:
+        try:
+            while (msgs := self.get(inp)) is not _DONE:
+                records = [
+                    e.record for e in self.email.parse_messages(msgs) if e.record
+                ]
+                self.put(out, records)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.put(out, _DONE)
+
+    def flush(self, records: list) -> int:
+        df = self.email.to_frame(records)
+        self.sink.write(df)
+        return len(df)
+
+    def run(self, pages: Iterable[list[dict]]) -> int:
+        """Drain `pages` into the sink; returns the number of records written"""
+        self.stop.clear()
+        self.errors = []
+        raw: queue.Queue = queue.Queue(self.queue_size)
+        parsed: queue.Queue = queue.Queue(self.queue_size)
+        threads = [
+            threading.Thread(target=self.fetch, args=(pages, raw), daemon=True),
+            threading.Thread(target=self.parse, args=(raw, parsed), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        n_written = 0
+        chunk: list[dict] = []
+        try:
+            while (records := self.get(parsed)) is not _DONE:
+                chunk.extend(records)
+                while len(chunk) >= self.chunk_size:
+                    n_written += self.flush(chunk[: self.chunk_size])
+                    chunk = chunk[self.chunk_size :]
+            if chunk and not self.errors:
+                n_written += self.flush(chunk)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self.sink.close()
+        if self.errors:
+            raise self.errors[0]
+        self.lg.info(f"pipeline done; {n_written} records written")
+        return n_written
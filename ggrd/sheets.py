@@ -1,6 +1,12 @@
+import dataclasses
+import hashlib
 import os
+import time
 import warnings
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
 
 import gspread
 from gspread.worksheet import Worksheet
@@ -8,24 +14,172 @@ import pandas as pd
 
 try:
     from auth import GoogleAuthManager
-    from utils import DATETIME_FMT, CustomLogger
+    from metrics import METRICS
+    from utils import (
+        DATETIME_FMT,
+        CustomLogger,
+        JsonStateFile,
+        RateLimiter,
+        get_state_dirpath,
+    )
 except ImportError:
     from ggrd.auth import GoogleAuthManager
-    from ggrd.utils import DATETIME_FMT, CustomLogger
+    from ggrd.metrics import METRICS
+    from ggrd.utils import (
+        DATETIME_FMT,
+        CustomLogger,
+        JsonStateFile,
+        RateLimiter,
+        get_state_dirpath,
+    )
 
 APP_NAME = "ggrd"
+# the sheets api rejects very large payloads; keep each write request well under
+MAX_REQUEST_BYTES = 2_000_000
+# https://developers.google.com/sheets/api/limits: 60 writes/min per user
+WRITE_REQUESTS_PER_MINUTE = 60
+WRITE_WORKERS = 4
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+STAGING_SUFFIX = "__staging"
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
+@dataclasses.dataclass
+class UpsertResult:
+    inserted: int
+    skipped: int
+
+
+def iter_row_chunks(
+    rows: list[list], max_bytes: int = MAX_REQUEST_BYTES
+) -> Iterator[list[list]]:
+    """Split rows into consecutive chunks of roughly max_bytes serialized size"""
+    chunk: list[list] = []
+    size = 0
+    for row in rows:
+        row_size = len(str(row))
+        if chunk and size + row_size > max_bytes:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def iter_row_ranges(
+    rows: list[list], max_bytes: int = MAX_REQUEST_BYTES
+) -> Iterator[tuple[str, list[list]]]:
+    """(A1 start cell, rows) for consecutive chunks of `rows` from row 1"""
+    start = 1
+    for chunk in iter_row_chunks(rows, max_bytes):
+        yield f"A{start}", chunk
+        start += len(chunk)
+
+
+def normalize_row(row: list) -> list[str]:
+    """Cell values as the sheet hands them back: strings, no trailing blanks"""
+    values = ["" if v is None else str(v) for v in row]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+class SheetMirror:
+    """Local summary of a worksheet, so incremental runs skip get_all_records.
+
+    Holds the header, the sheet row number of the last data row, the max
+    datetime, the set of `key` values (booking refs by default) and a
+    checksum of the last row. Together they make a cheap consistency check:
+    if the `key` column above `last_row` holds the same refs and the row at
+    `last_row` still hashes the same, only rows after it can be new.
+    `modified_time` is the drive modifiedTime seen right after our last write.
+    """
+
+    def __init__(self, filepath: Path, key: str = "booking_ref"):
+        self.state = JsonStateFile(filepath)
+        self.key = key
+        data = self.state.load()
+        self.columns: list[str] = data.get("columns", [])
+        self.last_row: int = data.get("last_row", 0)
+        self.max_datetime: Optional[str] = data.get("max_datetime")
+        self.booking_refs: set[str] = set(data.get("booking_refs", []))
+        self.checksum: str = data.get("checksum", "")
+        self.modified_time: Optional[str] = data.get("modified_time")
+
+    @staticmethod
+    def row_checksum(row: list) -> str:
+        return hashlib.sha1("\x1f".join(normalize_row(row)).encode()).hexdigest()
+
+    def rebuild(self, values: list[list]) -> None:
+        """Reset from every value in the worksheet, header row included"""
+        self.columns = normalize_row(values[0]) if values else []
+        self.last_row = 0
+        self.max_datetime = None
+        self.booking_refs = set()
+        self.checksum = ""
+        if values:
+            self.last_row = 1
+            self.checksum = self.row_checksum(values[0])
+            self.extend(values[1:])
+
+    def extend(self, rows: list[list]) -> None:
+        if not rows:
+            return
+        i_datetime = self.columns.index("datetime")
+        i_key = self.columns.index(self.key)
+        n_cells = max(i_datetime, i_key) + 1
+        for row in rows:
+            row = normalize_row(row)
+            # every non-blank key cell, as GoogleSheetClient.sync_mirror
+            # compares this set with the sheet's key column
+            if len(row) > i_key and row[i_key]:
+                self.booking_refs.add(row[i_key])
+            if len(row) < n_cells or not row[i_datetime]:
+                # a blank separator row (or one typed in by hand); still a row
+                # of the sheet, so it counts towards last_row below
+                continue
+            # DATETIME_FMT strings sort the same as the datetimes they encode
+            if self.max_datetime is None or row[i_datetime] > self.max_datetime:
+                self.max_datetime = row[i_datetime]
+        self.last_row += len(rows)
+        self.checksum = self.row_checksum(rows[-1])
+
+    def save(self) -> None:
+        self.state.save(
+            {
+                "columns": self.columns,
+                "last_row": self.last_row,
+                "max_datetime": self.max_datetime,
+                "booking_refs": sorted(self.booking_refs),
+                "checksum": self.checksum,
+                "modified_time": self.modified_time,
+            }
+        )
+
+
 class GoogleSheetClient:
     def __init__(
         self,
         spreadsheet_id: Optional[str] = None,
         spreadsheet_name: Optional[str] = None,
+        use_mirror: bool = True,
+        spreadsheet: Optional[gspread.Spreadsheet] = None,
+        gga: Optional[GoogleAuthManager] = None,
     ):
         self.lg = CustomLogger(APP_NAME).getLogger()
-        self.gga = GoogleAuthManager()
+        self.use_mirror = use_mirror
+        self.mirrors: dict[str, SheetMirror] = {}
+        # the write quota is per user, so one limiter for all bulk writes
+        self.write_limiter = RateLimiter(WRITE_REQUESTS_PER_MINUTE / 60, capacity=10)
+        if spreadsheet is not None:
+            # an already opened spreadsheet, e.g. an offline stand-in
+            self.gga = None
+            self.gs = None
+            self.ss = spreadsheet
+            return
+        self.gga = GoogleAuthManager() if gga is None else gga
         self.gs = self.gga.get_gspread()
         self.lg.debug("google sheets service loaded")
         if spreadsheet_id is not None:
@@ -70,21 +224,93 @@ class GoogleSheetClient:
             self.lg.error(f"read data from gsheet({sheet_name=}) failed; {e=}")
             return None
 
-    def update_data(self, dfin: pd.DataFrame, sheet_name: str = "data") -> None:
-        df = self.read_data(sheet_name=sheet_name)
+    def get_mirror(
+        self, sheet_name: str = "data", key: str = "booking_ref"
+    ) -> SheetMirror:
+        if sheet_name not in self.mirrors:
+            filepath = self.get_mirror_filepath(sheet_name)
+            self.mirrors[sheet_name] = SheetMirror(filepath, key=key)
+        return self.mirrors[sheet_name]
+
+    def get_mirror_filepath(self, sheet_name: str) -> Path:
+        return get_state_dirpath() / f"{self.ss.id}-{sheet_name}-mirror.json"
+
+    def sync_mirror(
+        self, sheet_name: str = "data", key: str = "booking_ref"
+    ) -> SheetMirror:
+        """Bring the local mirror up to date, reading as little as possible.
+
+        Nothing is read if the spreadsheet is unmodified since our last write.
+        Otherwise reads the `key` column, then the rows from the mirror's last
+        row to the end of the sheet. If the refs above the last row and the
+        anchor row itself are unchanged, any rows after it were appended
+        elsewhere and are folded in; if not, the sheet was edited or had rows
+        deleted out-of-band, and gets a full read.
+        """
+        mirror = self.get_mirror(sheet_name, key)
+        modified_time = self.ss.get_lastUpdateTime()
+        if mirror.last_row and modified_time == mirror.modified_time:
+            return mirror
+        worksheet = self.get_worksheet(sheet_name)
+        if mirror.last_row and key in mirror.columns:
+            column = worksheet.col_values(mirror.columns.index(key) + 1)
+            refs = {ref for ref in column[1 : mirror.last_row] if ref}
+            values = []
+            if refs == mirror.booking_refs:
+                values = worksheet.get(f"{mirror.last_row}:{worksheet.row_count}")
+            if values and mirror.row_checksum(values[0]) == mirror.checksum:
+                if len(values) > 1:
+                    self.lg.info(f"{len(values) - 1} rows appended out-of-band")
+                    mirror.extend(values[1:])
+                mirror.modified_time = modified_time
+                mirror.save()
+                return mirror
+            self.lg.warning(f"[worksheet-{sheet_name}]: changed out-of-band")
+        mirror.rebuild(worksheet.get_all_values())
+        mirror.modified_time = modified_time
+        mirror.save()
+        self.lg.info(f"[worksheet-{sheet_name}]: mirror rebuilt, {mirror.last_row=}")
+        return mirror
+
+    def update_data(
+        self, dfin: pd.DataFrame, sheet_name: str = "data", key: str = "booking_ref"
+    ) -> UpsertResult:
+        """Append rows whose `key` (booking_ref) is not in the sheet yet"""
+        if self.use_mirror:
+            if not self.sync_mirror(sheet_name, key).columns:
+                # a brand new worksheet; the mirror needs a header to index
+                self.clear_data(list(dfin.columns), sheet_name, key)
+            existing = self.get_mirror(sheet_name, key).booking_refs
+        else:
+            df = self.read_data(sheet_name=sheet_name)
+            if df is None:
+                raise RuntimeError("unable to read data")
+            # get_all_records turns numeric-looking cells to int
+            existing = set(df[key].astype(str)) if not df.empty else set()
         dfin = self.parse_data_for_gsheet(dfin)
 
+        refs = dfin[key].astype(str)
+        dfnew = dfin[~refs.isin(existing) & ~refs.duplicated()]
+
         worksheet = self.ss.worksheet(sheet_name)
-        current_row = len(df) + 2
-        for _, row in dfin.iterrows():
-            if (df["booking_ref"].eq(row.booking_ref)).any():
-                continue
-            range_name = f"A{current_row}"
-            worksheet.update(values=[row.tolist()], range_name=range_name)
-            current_row += 1
-            self.lg.info(f"[worksheet-{sheet_name}]: updated {range_name}")
+        rows = dfnew.values.tolist()
+        self.append_rows(worksheet, rows)
+        if self.use_mirror:
+            mirror = self.get_mirror(sheet_name, key)
+            mirror.extend(rows)
+            mirror.modified_time = self.ss.get_lastUpdateTime()
+            mirror.save()
+        result = UpsertResult(inserted=len(dfnew), skipped=len(dfin) - len(dfnew))
+        self.lg.info(f"[worksheet-{sheet_name}]: {result}")
+        return result
 
-        self.lg.info(f"updated {current_row-len(df)-2} entries")
+    def append_rows(self, worksheet: Worksheet, rows: list[list]) -> None:
+        # one append per chunk; usually a single request for the whole update
+        for chunk in iter_row_chunks(rows):
+            with METRICS.timer("stage", stage="sheets_write"):
+                worksheet.append_rows(chunk, value_input_option="RAW", table_range="A1")
+            METRICS.inc("rows_written", len(chunk), sheet=worksheet.title)
+            self.lg.info(f"[worksheet-{worksheet.title}]: appended {len(chunk)} rows")
 
     def get_worksheet(self, sheet_name: str) -> Worksheet:
         try:
@@ -96,27 +322,190 @@ class GoogleSheetClient:
             worksheet = self.ss.worksheet(sheet_name)
         return worksheet
 
-    def reset_and_write_data(self, df: pd.DataFrame, sheet_name: str = "data"):
+    def clear_data(
+        self, columns: list[str], sheet_name: str = "data", key: str = "booking_ref"
+    ) -> None:
+        """Empty the worksheet down to a header row, ready for update_data"""
         worksheet = self.get_worksheet(sheet_name)
         worksheet.clear()
+        worksheet.update(values=[columns], range_name="A1")
+        self.lg.info(f"[worksheet-{sheet_name}]: cleared")
+        if self.use_mirror:
+            mirror = self.get_mirror(sheet_name, key)
+            mirror.rebuild([columns])
+            mirror.modified_time = self.ss.get_lastUpdateTime()
+            mirror.save()
+
+    def reset_and_write_data(
+        self,
+        df: pd.DataFrame,
+        sheet_name: str = "data",
+        key: str = "booking_ref",
+        max_workers: int = WRITE_WORKERS,
+    ):
+        """Replace the worksheet with `df`, through a staging worksheet.
+
+        The staging worksheet is created at its final size, filled in chunks
+        of at most MAX_REQUEST_BYTES from `max_workers` threads within the
+        write quota, then swapped in by a single batchUpdate. Readers see the
+        old rows or the new ones, never a half-written sheet, and a failed
+        rebuild is safe to run again. Formulas pointing at the old worksheet
+        turn into #REF!.
+        """
         df = self.parse_data_for_gsheet(df)
-        worksheet.update(values=[list(df.columns)], range_name="A1")
-        worksheet.update(values=df.values.tolist(), range_name="A2")
+        rows = [list(df.columns)] + df.values.tolist()
+        staging = self.create_staging_worksheet(sheet_name, len(rows), len(df.columns))
+        self.write_ranges(staging, rows, max_workers=max_workers)
+        self.swap_worksheet(staging, sheet_name)
+        METRICS.inc("rows_written", len(df), sheet=sheet_name)
         self.lg.info(f"update completed. {df.shape=}")
+        if self.use_mirror:
+            mirror = self.get_mirror(sheet_name, key)
+            mirror.rebuild(rows)
+            mirror.modified_time = self.ss.get_lastUpdateTime()
+            mirror.save()
+
+    def create_staging_worksheet(
+        self, sheet_name: str, rows: int, cols: int
+    ) -> Worksheet:
+        title = f"{sheet_name}{STAGING_SUFFIX}"
+        try:
+            # left behind by a rebuild that failed part-way
+            self.ss.del_worksheet(self.ss.worksheet(title))
+            self.lg.warning(f"removed stale worksheet {title=}")
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+        return self.ss.add_worksheet(title, rows=max(rows, 1), cols=max(cols, 1))
+
+    def write_ranges(
+        self,
+        worksheet: Worksheet,
+        rows: list[list],
+        max_workers: int = WRITE_WORKERS,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+    ) -> None:
+        """Write `rows` from A1 as concurrent, size-bounded range updates.
+
+        Each chunk covers a fixed range, so retrying one (on 429 or 5xx)
+        can't duplicate rows.
+        """
+
+        def write(start: str, chunk: list[list]) -> None:
+            for attempt in range(max_retries + 1):
+                self.write_limiter.acquire()
+                try:
+                    with METRICS.timer("stage", stage="sheets_write"):
+                        worksheet.update(values=chunk, range_name=start)
+                    return
+                except gspread.exceptions.APIError as e:
+                    if e.code not in RETRYABLE_CODES or attempt == max_retries:
+                        raise e
+                    METRICS.inc("retries", api="sheets", method="values.update")
+                    self.lg.warning(
+                        f"[worksheet-{worksheet.title}]: {start} failed, {e.code=};"
+                        " retrying"
+                    )
+                    time.sleep(backoff * 2**attempt)
+
+        with ThreadPoolExecutor(
+            max_workers, thread_name_prefix=f"{APP_NAME}-sheets"
+        ) as executor:
+            futures = [
+                executor.submit(write, start, chunk)
+                for start, chunk in iter_row_ranges(rows)
+            ]
+            for future in futures:
+                future.result()
+        self.lg.info(
+            f"[worksheet-{worksheet.title}]: wrote {len(rows)} rows"
+            f" in {len(futures)} requests"
+        )
+
+    def swap_worksheet(self, staging: Worksheet, sheet_name: str) -> None:
+        """Delete `sheet_name` and rename `staging` to it, in one batchUpdate"""
+        requests = []
+        properties = {"sheetId": staging.id, "title": sheet_name}
+        try:
+            old = self.ss.worksheet(sheet_name)
+            requests.append({"deleteSheet": {"sheetId": old.id}})
+            properties["index"] = old.index
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+        fields = ",".join(name for name in properties if name != "sheetId")
+        requests.append(
+            {"updateSheetProperties": {"properties": properties, "fields": fields}}
+        )
+        # batchUpdate applies all of its requests or none of them
+        self.ss.batch_update({"requests": requests})
+        self.lg.info(f"[worksheet-{sheet_name}]: swapped in {staging.title}")
+
+    def sort_by_datetime(self, worksheet: Worksheet, key: str = "booking_ref") -> None:
+        """Sort the data rows of `worksheet` oldest first, in one sortRange.
+
+        For a worksheet filled out of order, e.g. by a streamed rebuild. The
+        sort moves the mirror's anchor row, so that row is read back.
+        """
+        mirror = self.get_mirror(worksheet.title, key) if self.use_mirror else None
+        if mirror is not None:
+            columns, last_row = mirror.columns, mirror.last_row
+        else:
+            columns = worksheet.row_values(1)
+            last_row = len(worksheet.col_values(1))
+        if last_row < 3:
+            return
+        end = gspread.utils.rowcol_to_a1(last_row, len(columns))
+        worksheet.sort((columns.index("datetime") + 1, "asc"), range=f"A2:{end}")
+        self.lg.info(f"[worksheet-{worksheet.title}]: sorted {last_row - 1} rows")
+        if mirror is not None:
+            mirror.checksum = mirror.row_checksum(
+                worksheet.get(f"{last_row}:{last_row}")[0]
+            )
+            mirror.modified_time = self.ss.get_lastUpdateTime()
+            mirror.save()
+
+    def commit_staging(self, staging: Worksheet, sheet_name: str = "data") -> None:
+        """swap_worksheet for a staging worksheet filled through update_data.
+
+        The staging worksheet's mirror becomes `sheet_name`'s, so the next
+        update_data doesn't have to read the sheet back.
+        """
+        # read before the swap renames it
+        staging_title = staging.title
+        self.swap_worksheet(staging, sheet_name)
+        if self.use_mirror and staging_title in self.mirrors:
+            mirror = self.mirrors.pop(staging_title)
+            staged_filepath = mirror.state.filepath
+            mirror.state = JsonStateFile(self.get_mirror_filepath(sheet_name))
+            mirror.modified_time = self.ss.get_lastUpdateTime()
+            mirror.save()
+            self.mirrors[sheet_name] = mirror
+            staged_filepath.unlink(missing_ok=True)
 
     def parse_data_for_gsheet(self, dfin: pd.DataFrame) -> pd.DataFrame:
         df = dfin.copy()
         df["datetime"] = df["datetime"].dt.strftime(DATETIME_FMT)
         return df
 
-    def get_last_entry_datetime(self, df: Optional[pd.DataFrame] = None):
+    def get_last_entry_datetime(
+        self,
+        df: Optional[pd.DataFrame] = None,
+        sheet_name: str = "data",
+        key: str = "booking_ref",
+    ):
+        if df is None and self.use_mirror:
+            mirror = self.sync_mirror(sheet_name, key)
+            if mirror.max_datetime is None:
+                raise RuntimeError("no data in sheet")
+            return datetime.strptime(mirror.max_datetime, DATETIME_FMT)
         if df is None:
-            df = self.read_data()
+            df = self.read_data(sheet_name)
         if df is None:
             raise RuntimeError("unable to read data")
-        ds = df.iloc[-1, :]
-        dt = ds["datetime"]
-        return dt
+        if df.empty:
+            raise RuntimeError("no data in sheet")
+        # not the last row: streamed pulls append newest page first
+        return df["datetime"].max()
 
 
 def main():
@@ -0,0 +1,179 @@
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional; only BookingStore needs it
+    pa = None
+
+try:
+    from sheets import UpsertResult
+    from utils import CustomLogger, get_state_dirpath
+except ImportError:
+    from ggrd.sheets import UpsertResult
+    from ggrd.utils import CustomLogger, get_state_dirpath
+
+APP_NAME = "ggrd"
+ROW_GROUP_SIZE = 64_000
+
+
+def booking_schema() -> "pa.Schema":
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("datetime", pa.timestamp("ms")),
+            ("booking_ref", pa.string()),
+            ("membership_no", pa.string()),
+            ("membership_name", category),
+            ("class_name", category),
+            ("location", category),
+        ]
+    )
+
+
+class BookingStore:
+    """Local Parquet copy of the bookings, partitioned by year and month.
+
+    Writes are append-only: each append adds files for the bookings whose
+    booking_ref is not stored yet. Queries read only the columns they need,
+    and date filters skip whole partitions and row groups (by their min/max
+    statistics). The sheet can be regenerated from here at any time.
+    """
+
+    def __init__(self, dirpath: Optional[Path] = None):
+        if pa is None:
+            raise ImportError("BookingStore requires pyarrow; pip install pyarrow")
+        self.lg = CustomLogger(APP_NAME).getLogger()
+        if dirpath is None:
+            dirpath = get_state_dirpath() / "bookings"
+        self.dirpath = Path(dirpath)
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        self.schema = booking_schema()
+        partition_schema = pa.schema([("year", pa.int16()), ("month", pa.int8())])
+        self.partitioning = ds.partitioning(partition_schema, flavor="hive")
+        # partition fields live in directory names, not in the files
+        self.dataset_schema = pa.unify_schemas([self.schema, partition_schema])
+        self._booking_refs: Optional[set[str]] = None
+
+    def dataset(self) -> "ds.Dataset":
+        return ds.dataset(
+            self.dirpath,
+            schema=self.dataset_schema,
+            format="parquet",
+            partitioning=self.partitioning,
+        )
+
+    def booking_refs(self) -> set[str]:
+        # one column of the whole store, read once per instance
+        if self._booking_refs is None:
+            table = self.dataset().to_table(columns=["booking_ref"])
+            self._booking_refs = set(table.column("booking_ref").to_pylist())
+        return self._booking_refs
+
+    def append(self, df: pd.DataFrame) -> UpsertResult:
+        """Store rows whose booking_ref is new; returns what was inserted"""
+        existing = self.booking_refs()
+        refs = df["booking_ref"].astype(str)
+        is_new = ~refs.isin(existing) & ~refs.duplicated()
+        dfnew = df[is_new].assign(booking_ref=refs[is_new])
+        if not dfnew.empty:
+            table = pa.Table.from_pandas(
+                dfnew, schema=self.schema, preserve_index=False
+            )
+            dates = pd.DatetimeIndex(dfnew["datetime"])
+            table = table.append_column(
+                "year", pa.array(dates.year, pa.int16())
+            ).append_column("month", pa.array(dates.month, pa.int8()))
+            ds.write_dataset(
+                table,
+                self.dirpath,
+                format="parquet",
+                partitioning=self.partitioning,
+                basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                max_rows_per_group=ROW_GROUP_SIZE,
+            )
+            existing.update(dfnew["booking_ref"])
+        result = UpsertResult(inserted=len(dfnew), skipped=len(df) - len(dfnew))
+        self.lg.info(f"[store]: {result}")
+        return result
+
+    def date_filter(
+        self, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> Optional["ds.Expression"]:
+        """Bookings with start <= datetime < end; the partition terms let
+        whole year/month directories be skipped without opening them"""
+        year, month = ds.field("year"), ds.field("month")
+        expr = None
+        if start is not None:
+            expr = (ds.field("datetime") >= pa.scalar(start, pa.timestamp("ms"))) & (
+                (year > start.year) | ((year == start.year) & (month >= start.month))
+            )
+        if end is not None:
+            before = (ds.field("datetime") < pa.scalar(end, pa.timestamp("ms"))) & (
+                (year < end.year) | ((year == end.year) & (month <= end.month))
+            )
+            expr = before if expr is None else expr & before
+        return expr
+
+    def read(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        columns: Optional[list[str]] = None,
+    ) -> pd.DataFrame:
+        """Bookings in [start, end), oldest first"""
+        columns = self.schema.names if columns is None else columns
+        if "datetime" not in columns:
+            columns = [*columns, "datetime"]
+        table = self.dataset().to_table(
+            columns=columns, filter=self.date_filter(start, end)
+        )
+        df = table.sort_by("datetime").to_pandas()
+        df["datetime"] = df["datetime"].astype("datetime64[ns]")
+        return df
+
+    def counts(
+        self,
+        by: str = "class_name",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> pd.Series:
+        """Number of bookings per value of `by`, reading that column only"""
+        table = self.dataset().to_table(
+            columns=[by], filter=self.date_filter(start, end)
+        )
+        if pa.types.is_dictionary(table.schema.field(by).type):
+            table = table.cast(pa.schema([(by, pa.string())]))
+        counts = table.group_by(by).aggregate([(by, "count")])
+        series = counts.to_pandas().set_index(by)[f"{by}_count"]
+        return series.sort_values(ascending=False).rename("count")
+
+    def compact(self) -> None:
+        """Rewrite each partition as one file, after many small appends.
+
+        The merged file is in place before the old ones are removed, so a
+        crash part-way leaves duplicate rows, never missing ones.
+        """
+        partitions: dict[Path, list[Path]] = {}
+        for filepath in self.dirpath.glob("year=*/month=*/*.parquet"):
+            partitions.setdefault(filepath.parent, []).append(filepath)
+        for dirpath, filepaths in partitions.items():
+            if len(filepaths) < 2:
+                continue
+            table = ds.dataset(filepaths, schema=self.schema, format="parquet")
+            table = table.to_table().sort_by("datetime")
+            name = f"part-{uuid.uuid4().hex}-0"
+            # "_" hides a half-written file from ds.dataset if we crash here
+            tmp_filepath = dirpath / f"_{name}.tmp"
+            pq.write_table(table, tmp_filepath, row_group_size=ROW_GROUP_SIZE)
+            tmp_filepath.replace(dirpath / f"{name}.parquet")
+            for filepath in filepaths:
+                filepath.unlink()
+            self.lg.info(f"[store]: compacted {len(filepaths)} files in {dirpath}")
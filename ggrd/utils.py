@@ -1,14 +1,149 @@
+import atexit
+import copy
+import json
 import logging
-import shutil
-import tempfile
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
 APP_NAME = "ggrd"
 DATETIME_FMT = "%Y-%m-%d %H:%M:%S"
 
 
+def get_state_dirpath() -> Path:
+    """Directory for state that must survive between runs (checkpoints etc.)"""
+    dirpath = Path(os.getenv("GGRD_STATE_DIR", Path(__file__).parent / "state"))
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
+
+
+class RateLimiter:
+    """Blocking token bucket shared by threads: `rate` acquisitions per
+    second, in bursts of up to `capacity` (the sync twin of
+    gmail_async.TokenBucket)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class JsonStateFile:
+    def __init__(self, filepath: Path):
+        self.filepath = filepath
+
+    def load(self) -> dict:
+        if not self.filepath.is_file():
+            return {}
+        with open(self.filepath, "r") as fp:
+            return json.load(fp)
+
+    def save(self, data: dict) -> None:
+        # write then rename, so a crash never leaves a truncated file behind
+        tmp_filepath = self.filepath.with_suffix(".tmp")
+        with open(tmp_filepath, "w") as fp:
+            json.dump(data, fp)
+        tmp_filepath.replace(self.filepath)
+
+
+def get_log_dirpath() -> Path:
+    """Persistent log directory: $GGRD_LOG_DIR, else state/logs"""
+    dirpath = os.getenv("GGRD_LOG_DIR")
+    dirpath = Path(dirpath) if dirpath else get_state_dirpath() / "logs"
+    dirpath.mkdir(parents=True, exist_ok=True)
+    return dirpath
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller on a full queue for
+    records below WARNING: they are dropped and counted, and a summary
+    record takes their place once the listener catches up. Warnings and
+    errors wait for room instead of being lost."""
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # merge the args now, since they may change after the call returns;
+        # formatting proper happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            if self.dropped:
+                self.enqueue_summary(record)
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+
+    def enqueue_summary(self, record: logging.LogRecord) -> None:
+        with self.dropped_lock:
+            n_dropped, self.dropped = self.dropped, 0
+        summary = logging.makeLogRecord(
+            {
+                "name": record.name,
+                "levelno": logging.WARNING,
+                "levelname": logging.getLevelName(logging.WARNING),
+                "msg": f"log queue full; dropped {n_dropped} records",
+            }
+        )
+        try:
+            self.queue.put_nowait(summary)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += n_dropped
+            raise
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # the stock put_nowait fails when the queue is full of records
+        # still to be written; wait for room instead
+        self.queue.put(self._sentinel)
+
+
+# one background listener per logger name, shared by its CustomLoggers
+LISTENERS: dict[str, DrainingQueueListener] = {}
+
+
 class CustomLogger:
+    """Console and rotating-file logging for `name`.
+
+    With `use_queue`, callers only put records on a bounded queue and a
+    QueueListener thread formats and writes them (see DroppingQueueHandler).
+    Log files go to `log_dirpath`, by default get_log_dirpath(), and are
+    kept between runs.
+    """
+
     def __init__(
         self,
         name: str = __name__,
@@ -19,37 +154,57 @@ class CustomLogger:
         logfile_datefmt: str = DATETIME_FMT,
         rotating_maxBytes: int = 2_097_152,
         rotating_backupCount: int = 5,
-        cleanup_on_exit: bool = True,
+        use_queue: bool = True,
+        queue_size: int = 10_000,
+        log_dirpath: Optional[Path] = None,
     ):
-        self.tempdir = None
-        self.cleanup_on_exit = cleanup_on_exit
         self.name = name
         self.level = level
         self.console_fmt = logging.Formatter(fmt=console_fmt, datefmt=console_datefmt)
         self.logfile_fmt = logging.Formatter(fmt=logfile_fmt, datefmt=logfile_datefmt)
         self.rotating_maxBytes = rotating_maxBytes
         self.rotating_backupCount = rotating_backupCount
+        self.use_queue = use_queue
+        self.queue_size = queue_size
+        self.log_dirpath = log_dirpath
         self.logger = None
         self.logger = self.getLogger()
 
+    def make_handlers(self) -> list[logging.Handler]:
+        c_handler = logging.StreamHandler()
+        c_handler.setFormatter(self.console_fmt)
+        c_handler.setLevel(self.level)
+
+        log_dirpath = self.log_dirpath
+        if log_dirpath is None:
+            log_dirpath = get_log_dirpath()
+        self.logfilepath = Path(log_dirpath) / f"{self.name}.log"
+        f_handler = RotatingFileHandler(
+            self.logfilepath,
+            maxBytes=self.rotating_maxBytes,
+            backupCount=self.rotating_backupCount,
+        )
+        f_handler.setFormatter(self.logfile_fmt)
+        f_handler.setLevel(self.level)
+        return [c_handler, f_handler]
+
     def make_logger(self, logger) -> logging.Logger:
         try:
             logger.setLevel(self.level)
-            c_handler = logging.StreamHandler()
-            c_handler.setFormatter(self.console_fmt)
-            c_handler.setLevel(self.level)
-            logger.addHandler(c_handler)
-
-            self.tempdir = tempfile.mkdtemp(prefix=f"{APP_NAME}-logfiles-")
-            self.logfilepath = Path(self.tempdir) / f"{self.name}.log"
-            f_handler = RotatingFileHandler(
-                self.logfilepath,
-                maxBytes=self.rotating_maxBytes,
-                backupCount=self.rotating_backupCount,
-            )
-            f_handler.setFormatter(self.logfile_fmt)
-            f_handler.setLevel(self.level)
-            logger.addHandler(f_handler)
+            handlers = self.make_handlers()
+            if self.use_queue:
+                q = queue.Queue(maxsize=self.queue_size)
+                listener = DrainingQueueListener(
+                    q, *handlers, respect_handler_level=True
+                )
+                listener.start()
+                LISTENERS[self.name] = listener
+                # flush whatever is queued, even without run_cleanup
+                atexit.register(stop_listener, self.name)
+                logger.addHandler(DroppingQueueHandler(q))
+            else:
+                for handler in handlers:
+                    logger.addHandler(handler)
             logger.debug(f"logger initialized - {self.logfilepath}")
             return logger
         except Exception as e:
@@ -63,10 +218,18 @@ class CustomLogger:
         return self.make_logger(logger)
 
     def run_cleanup(self):
-        if self.logger is not None:
-            for handler in self.logger.handlers:
-                self.logger.removeHandler(handler)
-                handler.close()
+        """Flush queued records and close the handlers; log files are kept"""
+        stop_listener(self.name)
+        logger = logging.getLogger(self.name)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
 
-        if self.cleanup_on_exit and self.tempdir is not None:
-            shutil.rmtree(self.tempdir)
+def stop_listener(name: str) -> None:
+    listener = LISTENERS.pop(name, None)
+    if listener is None:
+        return
+    listener.stop()  # drains the queue first
+    for handler in listener.handlers:
+        handler.close()
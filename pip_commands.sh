@@ -1,3 +1,5 @@
 
 pip install --upgrade google-api-python-client google-auth-httplib2 google-auth-oauthlib
-pip install gspread
\ No newline at end of file
+pip install gspread
+pip install pyarrow  # optional, for the local booking store (ggrd.store)
+pip install pytest  # optional, for tests/
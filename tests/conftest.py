@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+BOUNDARY = "batch_ggrd"
+
+
+def json_response(status: int, body: dict) -> tuple[dict, str]:
+    return {"status": str(status)}, json.dumps(body)
+
+
+def error_body(status: int, message: str = "error") -> dict:
+    return {"error": {"code": status, "message": message}}
+
+
+def batch_response(items: dict[str, tuple[int, dict]]) -> tuple[dict, str]:
+    """A recorded batch reply: message id -> (status, body) for each part"""
+    parts = []
+    for request_id, (status, body) in items.items():
+        parts.append(
+            f"--{BOUNDARY}\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-ggrd + {request_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n"
+            f"{json.dumps(body)}\r\n"
+        )
+    headers = {
+        "status": "200",
+        "content-type": f"multipart/mixed; boundary={BOUNDARY}",
+    }
+    return headers, "".join(parts) + f"--{BOUNDARY}--"
+
+
+def message(message_id: str, subject: str = "Your booking") -> dict:
+    return {
+        "id": message_id,
+        "internalDate": "1700000000000",
+        "payload": {
+            "mimeType": "text/html",
+            "headers": [{"name": "Subject", "value": subject}],
+            "body": {"data": ""},
+        },
+    }
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    # checkpoints, caches and mirrors go to a fresh directory per test
+    monkeypatch.setenv("GGRD_STATE_DIR", str(tmp_path / "state"))
+    return tmp_path / "state"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("ggrd.gmail.time.sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def gmail_service():
+    """A gmail service answering with `responses`, in call order"""
+
+    def make(responses: list[tuple[dict, str]]):
+        http = HttpMockSequence(responses)
+        return build("gmail", "v1", http=http, static_discovery=True)
+
+    return make
@@ -0,0 +1,53 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+from ggrd.gmail import EmailClient
+from tests.conftest import batch_response, error_body, json_response, message
+
+
+def test_execute_batch_retries_failed_items(gmail_service):
+    service = gmail_service(
+        [
+            batch_response({"m1": (200, message("m1")), "m2": (503, error_body(503))}),
+            batch_response({"m2": (200, message("m2"))}),
+        ]
+    )
+    fetched, dropped = EmailClient(service=service).execute_batch(["m1", "m2"])
+    assert sorted(fetched) == ["m1", "m2"]
+    assert dropped == []
+
+
+def test_execute_batch_retries_whole_batch_429(gmail_service):
+    service = gmail_service(
+        [
+            json_response(429, error_body(429, "rateLimitExceeded")),
+            batch_response({"m1": (200, message("m1")), "m2": (200, message("m2"))}),
+        ]
+    )
+    fetched, dropped = EmailClient(service=service).execute_batch(["m1", "m2"])
+    assert sorted(fetched) == ["m1", "m2"]
+    assert dropped == []
+
+
+def test_execute_batch_skips_deleted_messages(gmail_service):
+    # a 404 is not retried, and not reported as a failure either
+    service = gmail_service(
+        [batch_response({"m1": (200, message("m1")), "m2": (404, error_body(404))})]
+    )
+    fetched, dropped = EmailClient(service=service).execute_batch(["m1", "m2"])
+    assert list(fetched) == ["m1"]
+    assert dropped == []
+
+
+def test_execute_batch_reports_ids_failing_every_retry(gmail_service):
+    failing = batch_response({"m1": (503, error_body(503))})
+    service = gmail_service([failing] * 3)
+    fetched, dropped = EmailClient(service=service).execute_batch(["m1"], max_retries=2)
+    assert fetched == {}
+    assert dropped == ["m1"]
+
+
+def test_execute_batch_raises_non_retryable_batch_error(gmail_service):
+    service = gmail_service([json_response(400, error_body(400))])
+    with pytest.raises(HttpError):
+        EmailClient(service=service).execute_batch(["m1"])
@@ -0,0 +1,26 @@
+from unittest import mock
+
+import pytest
+
+from ggrd.gmail import FetchError, OutpostEmailClient
+from ggrd.outpost import Outpost
+from tests.conftest import batch_response, error_body, json_response
+
+
+def test_pull_keeps_checkpoint_on_fetch_error(gmail_service):
+    history = {
+        "history": [{"messagesAdded": [{"message": {"id": "m1"}}]}],
+        "historyId": "200",
+    }
+    failing = batch_response({"m1": (503, error_body(503))})
+    service = gmail_service([json_response(200, history)] + [failing] * 4)
+    gsc = mock.Mock()
+    op = Outpost(email=OutpostEmailClient(service=service), gsc=gsc, gga=object())
+    op.checkpoint.save({"history_id": "100"})
+
+    with pytest.raises(FetchError) as e:
+        op.pull_updates_from_email()
+
+    assert e.value.message_ids == ["m1"]
+    assert op.checkpoint.load() == {"history_id": "100"}
+    gsc.update_data.assert_not_called()
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+from benchmarks.fake_google import FakeSpreadsheet
+from ggrd.sheets import GoogleSheetClient
+
+COLUMNS = ["datetime", "booking_ref", "class_name"]
+
+
+def bookings(start: int, n: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "datetime": pd.date_range("2024-01-01", periods=start + n, freq="h")[
+                start:
+            ],
+            "booking_ref": [f"OP{i}" for i in range(start, start + n)],
+            "class_name": ["Open Session"] * n,
+        }
+    )
+
+
+@pytest.fixture
+def ss():
+    ss = FakeSpreadsheet()
+    ss.seed("data", [COLUMNS])
+    return ss
+
+
+@pytest.fixture
+def gsc(ss):
+    gsc = GoogleSheetClient(spreadsheet=ss)
+    gsc.update_data(bookings(0, 5))
+    return gsc
+
+
+def test_mirror_folds_in_rows_appended_elsewhere(ss, gsc):
+    ss.worksheets["data"].append_rows([["2024-01-02 00:00:00", "OP99", "Yoga"]])
+    ss.counters.reset()
+    assert gsc.update_data(bookings(0, 6)).inserted == 1
+    assert gsc.get_mirror().last_row == 8
+    # the key column and the rows from the anchor on; no full read
+    assert ss.counters.snapshot()["calls"].get("values.get") == 2
+
+
+def test_mirror_rebuilds_after_edit_above_last_row(ss, gsc):
+    ss.worksheets["data"].values[2][1] = "EDITED"
+    ss.touch()
+    assert gsc.update_data(bookings(0, 5)).inserted == 1
+    assert "EDITED" in gsc.get_mirror().booking_refs
+
+
+def test_mirror_rebuilds_after_row_deleted(ss, gsc):
+    del ss.worksheets["data"].values[2]
+    ss.touch()
+    assert gsc.update_data(bookings(0, 5)).inserted == 1
+    assert gsc.get_mirror().last_row == 6
+
+
+def test_mirror_skips_blank_rows(ss, gsc):
+    ss.worksheets["data"].append_rows([[], ["", "", ""]])
+    assert gsc.update_data(bookings(5, 1)).inserted == 1
+    assert gsc.get_last_entry_datetime() == bookings(5, 1)["datetime"].iloc[0]